@@ -8,6 +8,7 @@ class Settings(BaseSettings):
     redis_url: str = "redis://localhost:6379"
     max_file_size: int = 10485760  # 10MB
     allowed_origins: List[str] = ["http://localhost:3000"]
+    agent_workers: int = 8  # エージェント実行用スレッド数
     
     class Config:
         env_file = ".env"
@@ -1,32 +1,101 @@
 import asyncio
-import io
-import json
+import threading
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
-from datetime import datetime, timedelta
+from datetime import datetime
+from functools import partial
+from typing import Any, Dict, Optional, Tuple
 
+import orjson
 import pandas as pd
 import redis
+import redis.asyncio as aioredis
 from fastapi import FastAPI, File, HTTPException, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
+from openai import OpenAI
 
 from app.config import settings
 from app.models import QueryRequest, QueryResponse, SessionInfo
 from csv_agents.csv_agent import CSVAgent
+from services.csv_loader import optimize_dtypes, read_csv_bytes
+from services.session_store import (
+    SESSION_TTL,
+    build_manifest,
+    column_key,
+    load_columns,
+    meta_key,
+    serialize_columns,
+)
+
+
+# Redis client（DataFrameをバイナリで保存するためデコードしない）
+# エンドポイントではイベントループを止めない非同期クライアントを使い、
+# エージェント実行スレッドからの列読み込みには同期クライアントを使う
+async_redis_client = aioredis.from_url(settings.redis_url, decode_responses=False)
+redis_client = redis.from_url(settings.redis_url, decode_responses=False)
+
+# セッションごとのCSVAgentキャッシュ（session_id -> (agent, 有効期限のUNIX時刻)）
+_agent_cache: Dict[str, Tuple[CSVAgent, float]] = {}
+_agent_cache_lock = threading.Lock()
+
+
+def _get_cached_agent(session_id: str) -> Optional[CSVAgent]:
+    """キャッシュ済みのエージェントを取得（期限切れのエントリはここで削除）"""
+    now = time.time()
+    with _agent_cache_lock:
+        expired = [sid for sid, (_, expires_at) in _agent_cache.items() if expires_at <= now]
+        for sid in expired:
+            del _agent_cache[sid]
+        
+        entry = _agent_cache.get(session_id)
+    
+    return entry[0] if entry else None
+
 
+def _cache_agent(session_id: str, agent: CSVAgent, created_at: str) -> None:
+    """Redisのセッションと同じ期限でエージェントをキャッシュ"""
+    expires_at = (datetime.fromisoformat(created_at) + SESSION_TTL).timestamp()
+    with _agent_cache_lock:
+        _agent_cache[session_id] = (agent, expires_at)
 
-# Redis client
-redis_client = redis.from_url(settings.redis_url, decode_responses=True)
+
+def _evict_agent(session_id: str) -> None:
+    """キャッシュからエージェントを削除"""
+    with _agent_cache_lock:
+        _agent_cache.pop(session_id, None)
+
+
+def _prepare_session_data(contents: bytes, filename: str) -> Tuple[Dict[str, Any], Dict[str, bytes]]:
+    """CSVをパースし、Redisに保存するマニフェストと列ごとのデータを作成"""
+    # CSVを読み込む（UTF-8優先、ダメならShift-JIS）
+    df = read_csv_bytes(contents)
+    
+    # dtypeを最適化してメモリ使用量を削減
+    df = optimize_dtypes(df)
+    
+    return build_manifest(df, filename), serialize_columns(df)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     print("Starting up CSV Query Agent API...")
+    # エージェント実行用のスレッドプールとOpenAIクライアントは全リクエストで共有
+    # （同期クライアントは単純な質問の処理で使う。Runnerは実行ごとに別のイベントループで
+    # 動くため、ループに紐づくAsyncOpenAIは共有せずAgents SDK既定のクライアントに任せる）
+    app.state.agent_executor = ThreadPoolExecutor(
+        max_workers=settings.agent_workers,
+        thread_name_prefix="agent"
+    )
+    app.state.openai_client = OpenAI(api_key=settings.openai_api_key)
     yield
     # Shutdown
     print("Shutting down CSV Query Agent API...")
+    app.state.agent_executor.shutdown(wait=False)
+    await async_redis_client.aclose()
 
 
 app = FastAPI(
@@ -64,40 +133,25 @@ async def upload_csv(file: UploadFile = File(...)):
         if len(contents) > settings.max_file_size:
             raise HTTPException(status_code=413, detail="File size exceeds maximum allowed size (10MB)")
         
-        # CSVを読み込む（エンコーディングを試行）
-        try:
-            df = pd.read_csv(io.StringIO(contents.decode('utf-8')))
-        except UnicodeDecodeError:
-            # UTF-8でダメならshift-jisを試す
-            try:
-                df = pd.read_csv(io.StringIO(contents.decode('shift-jis')))
-            except:
-                df = pd.read_csv(io.BytesIO(contents))
+        # パース・シリアライズはCPU処理のためワーカースレッドで実行
+        manifest, payloads = await asyncio.to_thread(_prepare_session_data, contents, file.filename)
         
         # セッションIDを生成
         session_id = str(uuid.uuid4())
         
-        # データをRedisに保存（30分間）
-        session_data = {
-            "filename": file.filename,
-            "columns": df.columns.tolist(),
-            "shape": df.shape,
-            "created_at": datetime.now().isoformat(),
-            "data": df.to_json(orient='records')
-        }
-        
-        redis_client.setex(
-            f"session:{session_id}",
-            timedelta(minutes=30),
-            json.dumps(session_data)
-        )
+        # マニフェストと列ごとのデータ（Arrow IPC）をRedisに保存（30分間）
+        async with async_redis_client.pipeline() as pipe:
+            pipe.setex(meta_key(session_id), SESSION_TTL, orjson.dumps(manifest, default=str))
+            for column, payload in payloads.items():
+                pipe.setex(column_key(session_id, column), SESSION_TTL, payload)
+            await pipe.execute()
         
         return JSONResponse(content={
             "session_id": session_id,
             "filename": file.filename,
-            "columns": df.columns.tolist(),
-            "rows": df.shape[0],
-            "columns_count": df.shape[1]
+            "columns": manifest["columns"],
+            "rows": manifest["shape"][0],
+            "columns_count": manifest["shape"][1]
         })
         
     except Exception as e:
@@ -108,23 +162,34 @@ async def upload_csv(file: UploadFile = File(...)):
 
 
 @app.post("/query")
-def query_csv(request: QueryRequest):
-    # セッションデータを取得
-    session_data = redis_client.get(f"session:{request.session_id}")
-    if not session_data:
-        raise HTTPException(status_code=404, detail="Session not found or expired")
+async def query_csv(request: QueryRequest):
+    # キャッシュ済みのエージェントがあればRedisからの復元を省略
+    agent = _get_cached_agent(request.session_id)
     
-    session_info = json.loads(session_data)
+    if agent is None:
+        # セッションのマニフェストを取得
+        session_data = await async_redis_client.get(meta_key(request.session_id))
+        if not session_data:
+            raise HTTPException(status_code=404, detail="Session not found or expired")
+        
+        session_info = orjson.loads(session_data)
     
     try:
-        # DataFrameを復元
-        df = pd.read_json(io.StringIO(session_info["data"]))
-        
-        # エージェントを初期化
-        agent = CSVAgent(df, session_info["filename"])
+        if agent is None:
+            # 列データはクエリ・ツールが参照したものだけを後から読み込む
+            df = pd.DataFrame(index=pd.RangeIndex(session_info["shape"][0]))
+            agent = CSVAgent(
+                df,
+                session_info["filename"],
+                manifest=session_info,
+                column_loader=partial(load_columns, redis_client, request.session_id),
+                client=app.state.openai_client,
+                executor=app.state.agent_executor
+            )
+            _cache_agent(request.session_id, agent, session_info["created_at"])
         
         # クエリを実行
-        result = asyncio.run(agent.process_query(request.query))
+        result = await agent.process_query(request.query)
         
         # ResponseCSVAgentオブジェクトから必要な情報を抽出
         visualization_data = None
@@ -151,21 +216,26 @@ def query_csv(request: QueryRequest):
 
 @app.get("/session/{session_id}")
 async def get_session(session_id: str):
-    session_data = redis_client.get(f"session:{session_id}")
+    session_data = await async_redis_client.get(meta_key(session_id))
     if not session_data:
         raise HTTPException(status_code=404, detail="Session not found or expired")
     
-    session_info = json.loads(session_data)
-    # データ本体は返さない
-    session_info.pop("data", None)
+    session_info = orjson.loads(session_data)
     
     return SessionInfo(**session_info)
 
 
 @app.delete("/session/{session_id}")
 async def delete_session(session_id: str):
-    result = redis_client.delete(f"session:{session_id}")
-    if result == 0:
+    _evict_agent(session_id)
+    session_data = await async_redis_client.get(meta_key(session_id))
+    if not session_data:
         raise HTTPException(status_code=404, detail="Session not found")
     
+    columns = orjson.loads(session_data)["columns"]
+    await async_redis_client.delete(
+        meta_key(session_id),
+        *[column_key(session_id, col) for col in columns]
+    )
+    
     return {"message": "Session deleted successfully"}
\ No newline at end of file
@@ -0,0 +1,5 @@
+"""pytestの共通設定"""
+import os
+
+# app.configのSettingsは読み込み時にAPIキーを要求する（テストではAPIを呼び出さない）
+os.environ.setdefault("OPENAI_API_KEY", "test")
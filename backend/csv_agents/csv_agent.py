@@ -1,18 +1,286 @@
-import json
+import asyncio
 import os
-from typing import Optional
+import re
+import threading
+from concurrent.futures import Executor
+from functools import lru_cache, partial, wraps
+from types import CodeType
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
+import numpy as np
+import orjson
 import pandas as pd
-from agents import Agent, Runner, function_tool
-from openai import OpenAI
-from pydantic import BaseModel
+from agents import Agent, ModelBehaviorError, Runner, function_tool
+from openai import APITimeoutError, OpenAI, RateLimitError
+from pydantic import BaseModel, ValidationError
 
 from app.config import settings
+from csv_agents import kernels
+from csv_agents.query_validator import QUERY_GLOBALS, compile_query
+from services.session_store import build_manifest
 
 # OpenAI API keyを環境変数に設定（トレーシング警告の抑制）
 if not os.getenv('OPENAI_API_KEY'):
     os.environ['OPENAI_API_KEY'] = settings.openai_api_key
 
+# 同時に実行するツール処理（pandas/NumPyの計算）の上限
+TOOL_CONCURRENCY = 10
+_tool_slots = threading.BoundedSemaphore(TOOL_CONCURRENCY)
+
+# OpenAI APIの一時的なエラーに対する再試行設定
+MAX_ATTEMPTS = 3
+RETRY_BASE_DELAY = 0.5  # 秒（試行ごとに2倍）
+
+
+def _offload(func):
+    """同期ツールをワーカースレッドで実行する非同期関数に変換
+
+    1ターンで複数のツール呼び出しがあった場合に並行して実行されるようにする。
+    """
+    def run_with_slot(*args, **kwargs):
+        with _tool_slots:
+            return func(*args, **kwargs)
+    
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await asyncio.to_thread(run_with_slot, *args, **kwargs)
+    
+    return wrapper
+
+
+def _retry(max_attempts: int = MAX_ATTEMPTS, base: float = RETRY_BASE_DELAY):
+    """レート制限・タイムアウト時に指数バックオフで再試行するデコレータ"""
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            for attempt in range(max_attempts):
+                try:
+                    return await func(*args, **kwargs)
+                except (RateLimitError, APITimeoutError):
+                    if attempt == max_attempts - 1:
+                        raise
+                    await asyncio.sleep(base * 2 ** attempt)
+        return wrapper
+    return decorator
+
+
+@lru_cache(maxsize=1)
+def _default_openai_client() -> OpenAI:
+    """プロセス内で共有するOpenAIクライアント（APIキーは固定のため1つでよい）"""
+    return OpenAI(api_key=settings.openai_api_key)
+
+
+# この要素数以上のfloat列はNumbaカーネルで集計する
+JIT_MIN_SIZE = 100_000
+
+# グラフデータとして返す最大点数（超える場合はサンプリング）
+MAX_POINTS = 5000
+
+# ヒストグラムのビン数
+HIST_BINS = 30
+
+# 点数がMAX_POINTSを超える場合、行を区間ごとの平均に集約するグラフの種類（それ以外は層化抽出で間引く）
+_BINNED_CHART_TYPES = frozenset({"line", "bar"})
+
+# Numbaカーネルで処理する集計
+_JIT_OPERATIONS = {
+    "sum": kernels.nansum,
+    "mean": kernels.nanmean,
+    "min": kernels.nanmin,
+    "max": kernels.nanmax,
+    "std": kernels.nanstd,
+    "var": kernels.nanvar,
+}
+
+# JIT_MIN_SIZE未満のfloat列と整数列はNumPyのNaN対応関数で集計する
+_NUMPY_OPERATIONS = {
+    "sum": np.nansum,
+    "mean": np.nanmean,
+    "min": np.nanmin,
+    "max": np.nanmax,
+    "std": partial(np.nanstd, ddof=1),
+    "var": partial(np.nanvar, ddof=1),
+}
+
+def _aggregations(array: np.ndarray) -> Dict[str, Callable[[np.ndarray], Any]]:
+    """配列に使う集計関数を選択（カーネルはfloat64で集計するため、整数列は常にNumPyで集計して型を保つ）"""
+    if array.dtype.kind == 'f' and array.size >= JIT_MIN_SIZE:
+        return _JIT_OPERATIONS
+    return _NUMPY_OPERATIONS
+
+
+# エージェントの既定のモデルと、出力形式の検証に失敗した場合に再実行するモデル
+DEFAULT_MODEL = "gpt-4o-mini"
+FALLBACK_MODEL = "gpt-4o"
+
+# 単純な質問の振り分け（ファストパス）に使うモデル
+FAST_ROUTE_MODEL = "gpt-4o-mini"
+
+# ファストパスで直接計算する集計とグラフの種類
+_FAST_OPERATIONS = frozenset({"sum", "mean", "median", "min", "max", "count", "std", "var"})
+_FAST_CHART_TYPES = frozenset({"bar", "line", "scatter", "hist", "pie"})
+
+# 振り分け結果のJSON Schema（Structured Outputs）
+_NULLABLE_STRING = {"type": ["string", "null"]}
+_ROUTE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "intent": {"type": "string", "enum": ["statistic", "visualization", "other"]},
+        "column": _NULLABLE_STRING,
+        "operation": _NULLABLE_STRING,
+        "chart_type": _NULLABLE_STRING,
+        "x_column": _NULLABLE_STRING,
+        "y_column": _NULLABLE_STRING,
+        "groupby_column": _NULLABLE_STRING,
+        "title": _NULLABLE_STRING,
+        "response_template": {"type": "string"},
+    },
+    "required": [
+        "intent", "column", "operation", "chart_type", "x_column",
+        "y_column", "groupby_column", "title", "response_template",
+    ],
+    "additionalProperties": False,
+}
+
+# プロンプトは不変の説明を先頭に置き、ファイルごとに変わる情報を末尾に置く
+# （OpenAIのプロンプトキャッシュは先頭一致で効くため）
+_ROUTE_INSTRUCTIONS = """Classify a question about a CSV file.
+
+- intent="statistic": the question asks for one statistic (sum, mean, median, min, max, count, std, var) of one column. Set column and operation.
+  "合計" -> sum, "平均" -> mean
+- intent="visualization": the question asks for a chart ("グラフ", "チャート", "示して"). Set chart_type (bar, line, scatter, hist, pie) and title.
+  Use groupby_column + y_column for totals per group (e.g. "月別"), x_column + y_column for x/y charts, and x_column alone for histograms.
+- intent="other": anything else, e.g. filtering, comparisons or multi-step analysis.
+
+response_template is the answer sentence in the same language as the question.
+For statistic, put the placeholder {{value}} where the computed number goes.
+For visualization, briefly describe the chart being shown.
+Use the exact column names and set unused fields to null.
+
+File: '{filename}'
+Columns: {columns}
+"""
+
+_AGENT_INSTRUCTIONS = """You are a helpful data analyst working with a CSV file.
+
+When answering questions:
+1. Always use the provided tools to analyze data
+2. For calculations, use calculate_statistics with appropriate operation
+3. For complex queries, use execute_pandas_query
+4. Create visualizations when it would be helpful
+5. Be precise with column names - they are case-sensitive
+6. Respond in the same language as the user's query
+
+For Japanese queries:
+- "合計" -> Use calculate_statistics with operation='sum'
+- "平均" -> Use calculate_statistics with operation='mean'
+- "グラフ" or "チャート" or "棒グラフ" or "示して" -> Use create_visualization
+- "月別" + "グラフ" -> Use create_visualization with groupby_column parameter
+- "グループ別" -> Use groupby_column parameter in create_visualization or execute appropriate pandas query
+
+IMPORTANT:
+1. When user asks for visualization (グラフ, チャート, 示して), ALWAYS use create_visualization tool
+2. For "月別の売り上げを棒グラフで示して", use create_visualization with chart_type='bar' and appropriate columns
+3. The create_visualization tool returns VISUALIZATION_PARAMS data, not image data
+
+The file '{filename}' has been loaded with {n_rows} rows.
+Available columns: {columns}
+"""
+
+# 数値列で1回にまとめて計算して結果をキャッシュする集計
+_BASIC_OPERATIONS = ("sum", "mean", "count")
+
+# 数値以外の列やJIT/NumPyで扱わない集計はpandasで計算する
+_PANDAS_OPERATIONS = {
+    "sum": pd.Series.sum,
+    "mean": pd.Series.mean,
+    "median": pd.Series.median,
+    "min": pd.Series.min,
+    "max": pd.Series.max,
+    "count": pd.Series.count,
+    "std": pd.Series.std,
+    "var": pd.Series.var,
+    "describe": lambda series: _describe_json(series.describe().to_dict()),
+}
+
+
+def _is_numeric_dtype(dtype) -> bool:
+    """NumPyの数値dtype（int/uint/float）かどうか"""
+    return isinstance(dtype, np.dtype) and dtype.kind in 'iuf'
+
+
+def _describe_json(summary: Dict[str, Any]) -> str:
+    """describeの結果をJSON文字列に変換（floatは小数点以下4桁に丸める）"""
+    return orjson.dumps(
+        {key: round(float(value), 4) if isinstance(value, float) else value for key, value in summary.items()},
+        default=str,
+        option=orjson.OPT_SERIALIZE_NUMPY
+    ).decode()
+
+
+def _describe_array(array: np.ndarray) -> str:
+    """数値配列に対してSeries.describe()と同じ項目の要約を作成"""
+    count, mean, std, lo, hi = kernels.describe_stats(array)
+    valid = array[~np.isnan(array)]
+    q25, q50, q75 = np.quantile(valid, [0.25, 0.5, 0.75]) if valid.size else (np.nan,) * 3
+    keys = ["count", "mean", "std", "min", "25%", "50%", "75%", "max"]
+    values = [count, mean, std, lo, q25, q50, q75, hi]
+    return _describe_json(dict(zip(keys, map(float, values))))
+
+
+def _bucket_means(x_values: pd.Series, y_values: np.ndarray) -> Tuple[pd.Series, np.ndarray]:
+    """行の順序を保ったままMAX_POINTS個の区間に分け、各区間の先頭のx値とyの平均値を返す"""
+    buckets = np.arange(y_values.size, dtype=np.int64) * MAX_POINTS // y_values.size
+    starts = np.flatnonzero(np.diff(buckets, prepend=-1))
+    values = y_values.astype(np.float64, copy=False)
+    valid = ~np.isnan(values)
+    sums = np.bincount(buckets[valid], weights=values[valid], minlength=MAX_POINTS)
+    counts = np.bincount(buckets[valid], minlength=MAX_POINTS)
+    # 値がすべて欠損の区間はNaN
+    with np.errstate(invalid='ignore'):
+        means = sums / counts
+    return x_values.iloc[starts], means
+
+
+def _stratified_sample(n_rows: int) -> np.ndarray:
+    """行をMAX_POINTS個の区間に分け、各区間から1行ずつ無作為に選んだ行番号（昇順）を返す"""
+    edges = np.arange(MAX_POINTS + 1, dtype=np.int64) * n_rows // MAX_POINTS
+    offsets = (np.random.default_rng(0).random(MAX_POINTS) * np.diff(edges)).astype(np.int64)
+    return edges[:-1] + offsets
+
+
+def _xy(x_values, y_values) -> Tuple[List[str], List[float]]:
+    """グラフ用のx（文字列）・y（float）のリストをまとめて変換（要素ごとの型変換を避ける）"""
+    x = x_values.astype(str).tolist()
+    y = np.asarray(y_values, dtype=np.float64).tolist()
+    return x, y
+
+
+def _bin_labels(edges: np.ndarray) -> pd.Index:
+    """ヒストグラムのビン中央値を桁区切りの固定小数点表記のラベルに変換（桁数はビン幅から決める）"""
+    width = edges[1] - edges[0] if edges.size > 1 else 0.0
+    decimals = max(0, int(np.ceil(-np.log10(width))) + 1) if width > 0 else 0
+    return pd.Index((edges[:-1] + edges[1:]) / 2).map(f"{{:,.{decimals}f}}".format)
+
+
+def _format_value(value: Any) -> str:
+    """集計値を回答文に埋め込む文字列に変換"""
+    if isinstance(value, (int, np.integer)):
+        return f"{value:,}"
+    if isinstance(value, (float, np.floating)):
+        return f"{value:,.2f}"
+    return str(value)
+
+
+def _format_statistic(column: str, operation: str, value: Any) -> str:
+    """calculate_statisticsの出力形式に整形（数値の整形は最終回答を作るLLMに任せる）"""
+    if operation == "describe":
+        return value
+    if isinstance(value, np.generic):
+        value = value.item()
+    return f"{operation} of {column}: {value}"
+
+
 class DataForGraph(BaseModel):
     x: list[str]
     y: list[float]
@@ -30,10 +298,75 @@ class ResponseCSVAgent(BaseModel):
     visualization_data: Optional[VisualizationParams]
 
 class CSVAgent:
-    def __init__(self, df: pd.DataFrame, filename: str):
+    def __init__(
+        self,
+        df: pd.DataFrame,
+        filename: str,
+        manifest: Optional[Dict[str, Any]] = None,
+        column_loader: Optional[Callable[[List[str]], pd.DataFrame]] = None,
+        client: Optional[OpenAI] = None,
+        executor: Optional[Executor] = None,
+        model: str = DEFAULT_MODEL
+    ):
+        """
+        Args:
+            df: 分析対象のDataFrame（column_loaderを使う場合は一部の列のみでよい）
+            filename: CSVファイル名
+            manifest: 全列のスキーマ情報（省略時はdfから作成）
+            column_loader: 未ロードの列を読み込む関数（列名のリスト -> DataFrame）
+            client: 単純な質問の処理（_fast_route）で使用するOpenAIクライアント（省略時はプロセス共有のクライアント）。
+                Runnerによるエージェント実行はAgents SDK既定の非同期クライアントを使う
+            executor: エージェントを実行するExecutor（省略時は呼び出し元のイベントループで実行）
+            model: エージェントが使用するモデル
+        """
         self.df = df
         self.filename = filename
-        self.client = OpenAI(api_key=settings.openai_api_key)
+        self._client = client
+        self._executor = executor
+        
+        # 全列のスキーマ（dfにまだ読み込まれていない列も含む）
+        self.manifest = manifest or build_manifest(df, filename)
+        self.columns: List[str] = self.manifest["columns"]
+        self.n_rows: int = self.manifest["shape"][0]
+        self._column_loader = column_loader
+        self._column_lock = threading.Lock()
+        self._column_re = re.compile(
+            '|'.join(re.escape(col) for col in sorted(self.columns, key=len, reverse=True))
+        ) if self.columns else None
+        
+        # get_data_infoの結果（セッション中は変化しないため最初に作成しておく）
+        # 列データは読み込まずマニフェストの情報だけを返す
+        self._data_info_json = orjson.dumps(
+            {
+                "filename": self.filename,
+                "shape": f"{self.manifest['shape'][0]} rows × {self.manifest['shape'][1]} columns",
+                "columns": self.columns,
+                "dtypes": self.manifest["dtypes"],
+                "sample_data": self.manifest["sample_data"]
+            },
+            default=str,
+            option=orjson.OPT_NON_STR_KEYS
+        ).decode()
+        
+        # 列ごとのndarrayのキャッシュ（Seriesを経由せずに集計するため）
+        self._arrays: Dict[str, np.ndarray] = {}
+        
+        # グループ化キー列のfactorize結果のキャッシュ（列名 -> (グループ番号, ユニーク値)）
+        self._factorized: Dict[str, Tuple[np.ndarray, pd.Index]] = {}
+        
+        # 日付列の日単位のグループ番号とラベルのキャッシュ（列名 -> (グループ番号, ラベル)。解析できない列はNone）
+        self._date_codes: Dict[str, Optional[Tuple[np.ndarray, np.ndarray]]] = {}
+        
+        # calculate_statisticsの結果のキャッシュ（(列名, 集計) -> 集計値）
+        self._stat_cache: Dict[Tuple[str, str], Any] = {}
+        
+        # execute_pandas_queryの結果のキャッシュ（セッション中はデータが変わらないため）
+        self._query_results: Dict[CodeType, str] = {}
+        
+        # ファストパスの振り分け用プロンプト
+        self._route_instructions = _ROUTE_INSTRUCTIONS.format(
+            filename=self.filename, columns=', '.join(self.columns)
+        )
         
         # エージェントのツールを定義
         self.tools = [
@@ -46,95 +379,159 @@ class CSVAgent:
         # エージェントを作成
         self.agent = Agent(
             name="CSV Analyst",
-            instructions=f"""You are a helpful data analyst working with a CSV file.
-            The file '{self.filename}' has been loaded with the following columns: {', '.join(self.df.columns.tolist())}.
-            The data has {len(self.df)} rows.
-            
-            When answering questions:
-            1. Always use the provided tools to analyze data
-            2. For calculations, use calculate_statistics with appropriate operation
-            3. For complex queries, use execute_pandas_query
-            4. Create visualizations when it would be helpful
-            5. Be precise with column names - they are case-sensitive
-            6. Respond in the same language as the user's query
-            
-            Available columns: {', '.join(self.df.columns.tolist())}
-            
-            For Japanese queries:
-            - "合計" -> Use calculate_statistics with operation='sum'
-            - "平均" -> Use calculate_statistics with operation='mean'
-            - "グラフ" or "チャート" or "棒グラフ" or "示して" -> Use create_visualization
-            - "月別" + "グラフ" -> Use create_visualization with groupby_column parameter
-            - "グループ別" -> Use groupby_column parameter in create_visualization or execute appropriate pandas query
-            
-            IMPORTANT: 
-            1. When user asks for visualization (グラフ, チャート, 示して), ALWAYS use create_visualization tool
-            2. For "月別の売り上げを棒グラフで示して", use create_visualization with chart_type='bar' and appropriate columns
-            3. The create_visualization tool returns VISUALIZATION_PARAMS data, not image data
-            """,
+            instructions=_AGENT_INSTRUCTIONS.format(
+                filename=self.filename, columns=', '.join(self.columns), n_rows=self.n_rows
+            ),
             tools=self.tools,
-            model="gpt-4o",
+            model=model,
             output_type=ResponseCSVAgent
         )
+        
+        # 出力がResponseCSVAgentとして解釈できなかった場合に使う上位モデルのエージェント
+        self._fallback_agent = self.agent.clone(model=FALLBACK_MODEL) if model != FALLBACK_MODEL else None
+    
+    @property
+    def client(self) -> OpenAI:
+        """OpenAIクライアント（指定がなければ初回の利用時にプロセス共有のクライアントを作成）"""
+        if self._client is None:
+            self._client = _default_openai_client()
+        return self._client
+    
+    def referenced_columns(self, query: str) -> List[str]:
+        """クエリ文字列中に出現する列名を抽出"""
+        if self._column_re is None:
+            return []
+        return list(dict.fromkeys(self._column_re.findall(query)))
+    
+    def ensure_columns(self, columns: List[str]) -> None:
+        """未ロードの列をcolumn_loaderで読み込み、元の列順を保ってdfに追加"""
+        if self._column_loader is None:
+            return
+        
+        with self._column_lock:
+            loaded = set(self.df.columns)
+            missing = [col for col in self.columns if col in columns and col not in loaded]
+            if not missing:
+                return
+            
+            new_data = self._column_loader(missing)
+            for col in missing:
+                position = sum(1 for c in self.columns[:self.columns.index(col)] if c in loaded)
+                self.df.insert(position, col, new_data[col])
+                loaded.add(col)
+    
+    def _column_array(self, column: str) -> np.ndarray:
+        """列の値をndarrayとして取得（初回のみ変換してキャッシュ）"""
+        array = self._arrays.get(column)
+        if array is None:
+            array = self.df[column].to_numpy()
+            self._arrays[column] = array
+        return array
+    
+    def _factorize(self, column: str) -> Tuple[np.ndarray, pd.Index]:
+        """列をグループ番号とユニーク値に分解（初回のみ計算してキャッシュ）"""
+        factorized = self._factorized.get(column)
+        if factorized is None:
+            codes, uniques = pd.factorize(self.df[column], sort=False)
+            factorized = (codes, pd.Index(uniques))
+            self._factorized[column] = factorized
+        return factorized
+    
+    def _date_groups(self, column: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """日付列を日単位のグループ番号とラベルに変換（初回のみ解析してキャッシュ。解析できない場合はNone）"""
+        if column in self._date_codes:
+            return self._date_codes[column]
+        
+        series = self.df[column]
+        try:
+            if series.dtype.kind != 'M':
+                series = pd.to_datetime(series, cache=True)
+        except (ValueError, TypeError):
+            # 解析できない形式（例: 2024年01月01日）は呼び出し側で文字列のままグループ化する
+            self._date_codes[column] = None
+            return None
+        
+        days = series.to_numpy(dtype='datetime64[D]')
+        valid = ~np.isnat(days)
+        labels, inverse = np.unique(days[valid], return_inverse=True)
+        # 欠損日付のグループ番号は-1
+        codes = np.full(days.size, -1, dtype=np.int64)
+        codes[valid] = inverse
+        groups = (codes, labels.astype(str))
+        self._date_codes[column] = groups
+        return groups
     
     def _create_get_data_info_tool(self):
         """データ情報取得ツールを作成"""
-        df = self.df
-        filename = self.filename
-        
         @function_tool
         def get_data_info() -> str:
             """Get basic information about the dataset"""
-            try:
-                info = {
-                    "filename": filename,
-                    "shape": f"{df.shape[0]} rows × {df.shape[1]} columns",
-                    "columns": df.columns.tolist(),
-                    "dtypes": {col: str(dtype) for col, dtype in df.dtypes.items()},
-                    "sample_data": df.head(3).to_dict('records')
-                }
-                return json.dumps(info, ensure_ascii=False, default=str)
-            except Exception as e:
-                return f"Error getting data info: {str(e)}"
+            return self._data_info_json
         
         return get_data_info
     
+    def _basic_stats(self, column: str) -> Dict[str, Any]:
+        """数値列の合計・平均・件数をまとめて計算し、キャッシュに格納"""
+        array = self._column_array(column)
+        aggregations = _aggregations(array)
+        total = aggregations["sum"](array)
+        count = int(np.count_nonzero(array == array))
+        mean = total / count if count else np.nan
+        
+        results = dict(zip(_BASIC_OPERATIONS, (total, mean, count)))
+        for operation, result in results.items():
+            self._stat_cache[(column, operation)] = result
+        return results
+    
+    def _compute_statistic(self, column: str, operation: str) -> Any:
+        """列の統計量を計算（describeは要約の文字列を返す）"""
+        if _is_numeric_dtype(self.df[column].dtype):
+            # 合計・平均・件数は1回の計算でまとめて求める
+            if operation in _BASIC_OPERATIONS:
+                return self._basic_stats(column)[operation]
+            
+            # 大きな数値列のdescribeは1パスの集計と分位点計算で済ませる
+            array = self._column_array(column)
+            if operation == "describe" and array.size >= JIT_MIN_SIZE:
+                return _describe_array(array)
+            
+            # 数値列は生のndarrayを直接集計（大きなfloat列はNumbaカーネル）
+            if operation in _JIT_OPERATIONS:
+                aggregations = _aggregations(array)
+                return aggregations[operation](array)
+        
+        return _PANDAS_OPERATIONS[operation](self.df[column])
+    
+    def statistic(self, column: str, operation: str) -> Any:
+        """列の統計量を取得（セッション中はデータが変わらないため、同じ集計は再計算しない）"""
+        cached = self._stat_cache.get((column, operation))
+        if cached is not None:
+            return cached
+        
+        self.ensure_columns([column])
+        result = self._compute_statistic(column, operation)
+        self._stat_cache[(column, operation)] = result
+        return result
+    
     def _create_calculate_statistics_tool(self):
         """統計計算ツールを作成"""
-        df = self.df
-        
         @function_tool
+        @_offload
         def calculate_statistics(column: str, operation: str = "sum") -> str:
             """Calculate statistics for a specific column
             
             Args:
                 column: The column name to calculate statistics for
-                operation: The operation to perform (sum, mean, median, min, max, count, std, describe)
+                operation: The operation to perform (sum, mean, median, min, max, count, std, var, describe)
             """
             try:
-                if column not in df.columns:
-                    return f"Error: Column '{column}' not found. Available columns: {', '.join(df.columns.tolist())}"
-                
-                operations = {
-                    "sum": lambda: df[column].sum(),
-                    "mean": lambda: df[column].mean(),
-                    "median": lambda: df[column].median(),
-                    "min": lambda: df[column].min(),
-                    "max": lambda: df[column].max(),
-                    "count": lambda: df[column].count(),
-                    "std": lambda: df[column].std(),
-                    "describe": lambda: df[column].describe().to_string()
-                }
-                
-                if operation not in operations:
-                    return f"Error: Unknown operation '{operation}'. Use: {', '.join(operations.keys())}"
-                
-                result = operations[operation]()
+                if column not in self.columns:
+                    return f"Error: Column '{column}' not found. Available columns: {', '.join(self.columns)}"
                 
-                if operation == "describe":
-                    return result
+                if operation not in _PANDAS_OPERATIONS:
+                    return f"Error: Unknown operation '{operation}'. Use: {', '.join(_PANDAS_OPERATIONS.keys())}"
                 
-                return f"{operation} of {column}: {result:,.2f}" if isinstance(result, (int, float)) else f"{operation} of {column}: {result}"
+                return _format_statistic(column, operation, self.statistic(column, operation))
                 
             except Exception as e:
                 return f"Error calculating statistics: {str(e)}"
@@ -146,6 +543,7 @@ class CSVAgent:
         df = self.df  # クロージャでDataFrameを捕捉
         
         @function_tool
+        @_offload
         def execute_pandas_query(query: str) -> str:
             """Execute a pandas query on the dataframe
             
@@ -153,35 +551,129 @@ class CSVAgent:
                 query: Pandas query to execute (e.g., "groupby('商品名')['売上金額'].sum()")
             """
             try:
-                # セキュリティのため、一部の操作を制限
-                forbidden_ops = ['__', 'import', 'open', 'file', 'input', 'raw_input', 'compile', 'globals', 'locals']
-                if any(op in query.lower() for op in forbidden_ops):
-                    return "Error: Forbidden operation detected"
+                # セキュリティのため、ASTで許可された操作のみ実行する
+                code = compile_query(query)
+                cached = self._query_results.get(code)
+                if cached is not None:
+                    return cached
                 
-                # DataFrameの参照を使ってクエリを実行
-                # クエリがすでに"df."で始まっている場合は追加しない
-                if query.strip().startswith('df.'):
-                    result = eval(query, {"df": df, "pd": pd})
-                else:
-                    result = eval(f"df.{query}", {"df": df, "pd": pd})
+                # 任意の式はDataFrame全体を参照しうるため全列を読み込む
+                self.ensure_columns(self.columns)
+                result = eval(code, {**QUERY_GLOBALS, "df": df}, {})
                 
                 if isinstance(result, pd.DataFrame):
-                    return result.to_string()
+                    output = result.to_string()
                 elif isinstance(result, pd.Series):
-                    return result.to_string()
+                    output = result.to_string()
                 else:
-                    return str(result)
+                    output = str(result)
+                
+                self._query_results[code] = output
+                return output
                     
             except Exception as e:
                 return f"Error executing query: {str(e)}. Make sure the query is valid pandas syntax."
         
         return execute_pandas_query
     
-    def _create_create_visualization_tool(self):
-        """可視化ツールを作成"""
+    def visualization_params(
+        self,
+        chart_type: str,
+        x_column: Optional[str] = None,
+        y_column: Optional[str] = None,
+        title: Optional[str] = None,
+        groupby_column: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """可視化パラメータ（VisualizationParams相当のdict）を作成"""
         df = self.df
         
+        self.ensure_columns([col for col in (x_column, y_column, groupby_column) if col])
+        
+        # データを準備
+        if groupby_column and y_column:
+            # グループ化して集計（数値列はNumbaカーネルで合計し、上位MAX_POINTS件を返す）
+            if _is_numeric_dtype(df[y_column].dtype):
+                codes, uniques = self._factorize(groupby_column)
+                group_keys, group_sums = kernels.group_sum(
+                    codes, uniques, self._column_array(y_column), k=MAX_POINTS
+                )
+            else:
+                grouped_data = df.groupby(groupby_column, observed=True)[y_column].sum().sort_values(ascending=False).head(MAX_POINTS)
+                group_keys, group_sums = grouped_data.index, grouped_data.to_numpy(dtype=np.float64)
+            x, y = _xy(group_keys, group_sums)
+            chart_data = {
+                "x": x,
+                "y": y,
+                "x_label": groupby_column,
+                "y_label": y_column
+            }
+        elif x_column and y_column:
+            if x_column == "日付":
+                # 日付でグループ化して集計
+                date_groups = self._date_groups(x_column) if _is_numeric_dtype(df[y_column].dtype) else None
+                if date_groups is not None:
+                    # 事前に計算した日単位のグループ番号で集計（日付の昇順）
+                    codes, labels = date_groups
+                    values = self._column_array(y_column)
+                    valid = (codes >= 0) & (values == values)
+                    sums = np.bincount(codes[valid], weights=values[valid], minlength=labels.size)
+                    x, y = _xy(pd.Index(labels), sums)
+                else:
+                    date_grouped = df.groupby(x_column, observed=True)[y_column].sum()
+                    x, y = _xy(date_grouped.index, date_grouped.to_numpy(dtype=np.float64))
+                chart_data = {
+                    "x": x,
+                    "y": y,
+                    "x_label": x_column,
+                    "y_label": y_column
+                }
+            else:
+                # 通常のx,yデータ（点数が多い場合、折れ線・棒グラフは区間ごとの平均、
+                # 散布図などは行の区間ごとの層化抽出で、行の順序を保ったまま間引く）
+                x_values, y_values = df[x_column], self._column_array(y_column)
+                if len(df) > MAX_POINTS:
+                    if chart_type.lower() in _BINNED_CHART_TYPES and _is_numeric_dtype(df[y_column].dtype):
+                        x_values, y_values = _bucket_means(x_values, y_values)
+                    else:
+                        idx = _stratified_sample(len(df))
+                        x_values, y_values = x_values.iloc[idx], y_values[idx]
+                x, y = _xy(x_values, y_values)
+                chart_data = {
+                    "x": x,
+                    "y": y,
+                    "x_label": x_column,
+                    "y_label": y_column
+                }
+        elif x_column:
+            # ヒストグラム用のデータ（生の値は送らず、度数を集計して送る）
+            if _is_numeric_dtype(df[x_column].dtype):
+                values = self._column_array(x_column).astype(np.float64, copy=False)
+                counts, edges = np.histogram(values[~np.isnan(values)], bins=HIST_BINS)
+                x, y = _xy(_bin_labels(edges), counts)
+            else:
+                counts = df[x_column].value_counts().head(MAX_POINTS)
+                x, y = _xy(counts.index, counts.to_numpy())
+            chart_data = {
+                "x": x,
+                "y": y,
+                "x_label": x_column,
+                "y_label": "Frequency"
+            }
+        else:
+            raise ValueError("Missing required columns for visualization")
+        
+        # 可視化パラメータを返す
+        return {
+            "type": "VISUALIZATION_DATA",
+            "chart_type": chart_type.lower(),
+            "data_for_graph": chart_data,
+            "title": title or f"{chart_type.title()} Chart"
+        }
+    
+    def _create_create_visualization_tool(self):
+        """可視化ツールを作成"""
         @function_tool
+        @_offload
         def create_visualization(
             chart_type: str,
             x_column: Optional[str] = None,
@@ -199,69 +691,105 @@ class CSVAgent:
                 groupby_column: Column to group by before plotting
             """
             try:
-                # データを準備
-                if groupby_column and y_column:
-                    # グループ化して集計
-                    grouped_data = df.groupby(groupby_column)[y_column].sum().sort_values(ascending=False)
-                    chart_data = {
-                        "x": [str(x) for x in grouped_data.index.tolist()],
-                        "y": [float(y) for y in grouped_data.values.tolist()],
-                        "x_label": groupby_column,
-                        "y_label": y_column
-                    }
-                elif x_column and y_column:
-                    if x_column == "日付":
-                        # 日付でグループ化して集計
-                        date_grouped = df.groupby(x_column)[y_column].sum()
-                        chart_data = {
-                            "x": [str(x) for x in date_grouped.index.tolist()],
-                            "y": [float(y) for y in date_grouped.values.tolist()],
-                            "x_label": x_column,
-                            "y_label": y_column
-                        }
-                    else:
-                        # 通常のx,yデータ
-                        chart_data = {
-                            "x": [str(x) for x in df[x_column].tolist()],
-                            "y": [float(y) for y in df[y_column].tolist()],
-                            "x_label": x_column,
-                            "y_label": y_column
-                        }
-                elif x_column:
-                    # ヒストグラム用のデータ（yは空リスト）
-                    chart_data = {
-                        "x": [str(x) for x in df[x_column].tolist()],
-                        "y": [],  # ヒストグラムの場合、yは空リスト
-                        "x_label": x_column,
-                        "y_label": "Frequency"
-                    }
-                else:
-                    return "Error: Missing required columns for visualization"
-                
-                # 可視化パラメータを返す
-                viz_params = VisualizationParams(
-                    type="VISUALIZATION_DATA",
-                    chart_type=chart_type.lower(),
-                    data_for_graph=DataForGraph(**chart_data),
-                    title=title or f"{chart_type.title()} Chart"
-                )
-                
-                return viz_params.model_dump_json()
+                # x/yは作成時に文字列・floatのリストへ変換済みのため、モデルでの検証は省いてそのまま返す
+                params = self.visualization_params(chart_type, x_column, y_column, title, groupby_column)
+                return orjson.dumps(params).decode()
                 
             except Exception as e:
                 return f"Error preparing visualization: {str(e)}"
         
         return create_visualization
     
-    async def process_query(self, query: str) -> ResponseCSVAgent:
-        """クエリを処理してレスポンスを生成"""
+    @_retry()
+    async def _run_agent(self, query: str):
+        """エージェントを実行（一時的なAPIエラーは再試行）"""
         try:
-            # Runnerを使用してエージェントを実行
-            result = await Runner.run(
+            return await Runner.run(
                 self.agent,
                 query,
                 max_turns=20
             )
+        except (ModelBehaviorError, ValidationError):
+            if self._fallback_agent is None:
+                raise
+            # 出力形式の検証に失敗した場合は上位モデルで再実行する
+            return await Runner.run(
+                self._fallback_agent,
+                query,
+                max_turns=20
+            )
+    
+    def _run_agent_sync(self, query: str):
+        """Executorのスレッド上でエージェントを実行"""
+        # Runner.run_syncは現在のスレッドのイベントループを前提とするため、
+        # ワーカースレッドではasyncio.runで専用のループを使う
+        return asyncio.run(self._run_agent(query))
+    
+    def _fast_route(self, query: str) -> Optional[ResponseCSVAgent]:
+        """単純な集計・グラフの質問を1回のAPI呼び出しで処理（該当しない場合はNone）"""
+        try:
+            completion = self.client.chat.completions.create(
+                model=FAST_ROUTE_MODEL,
+                messages=[
+                    {"role": "system", "content": self._route_instructions},
+                    {"role": "user", "content": query}
+                ],
+                response_format={
+                    "type": "json_schema",
+                    "json_schema": {"name": "route", "strict": True, "schema": _ROUTE_SCHEMA}
+                },
+                temperature=0
+            )
+            route = orjson.loads(completion.choices[0].message.content)
+            template = route["response_template"]
+            
+            if route["intent"] == "statistic":
+                column, operation = route["column"], route["operation"]
+                if column not in self.columns or operation not in _FAST_OPERATIONS or "{value}" not in template:
+                    return None
+                value = self.statistic(column, operation)
+                return ResponseCSVAgent(
+                    result=template.replace("{value}", _format_value(value)),
+                    visualization_data=None
+                )
+            
+            if route["intent"] == "visualization":
+                columns = [route[key] for key in ("x_column", "y_column", "groupby_column") if route[key]]
+                if route["chart_type"] not in _FAST_CHART_TYPES or not all(col in self.columns for col in columns):
+                    return None
+                params = self.visualization_params(
+                    route["chart_type"], route["x_column"], route["y_column"],
+                    route["title"], route["groupby_column"]
+                )
+                return ResponseCSVAgent(
+                    result=template,
+                    visualization_data=VisualizationParams.model_validate(params)
+                )
+        
+        except Exception:
+            # 振り分けや計算に失敗した場合はエージェントで処理する
+            return None
+        
+        return None
+    
+    async def process_query(self, query: str) -> ResponseCSVAgent:
+        """クエリを処理してレスポンスを生成"""
+        try:
+            # クエリで言及された列はツール実行前にまとめて読み込む
+            # （Redisからの同期読み込みとArrowのデコードでイベントループを止めないようExecutorで実行）
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._executor, self.ensure_columns, self.referenced_columns(query))
+            
+            # 単純な質問はエージェントを使わずに回答する（API呼び出しは1回）
+            response = await loop.run_in_executor(self._executor, self._fast_route, query)
+            if response is not None:
+                return response
+            
+            # Runnerを使用してエージェントを実行
+            if self._executor is not None:
+                result = await loop.run_in_executor(self._executor, self._run_agent_sync, query)
+            else:
+                result = await self._run_agent(query)
             
             # output_type=ResponseCSVAgentを使用しているため、
             # result.final_outputがResponseCSVAgentオブジェクトになる
@@ -0,0 +1,163 @@
+"""数値列の集計用Numbaカーネル
+
+いずれもNaNをスキップし（pandasのskipna=Trueと同じ挙動）、float64で集計する。
+parallel=Trueのカーネルは複数のスレッドから同時に呼ぶと、スレッドセーフでない
+スレッド層（workqueue）ではプロセスが異常終了するため、ロックで直列に実行する。
+"""
+import threading
+from functools import wraps
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from numba import get_num_threads, njit, prange
+
+# parallel=Trueのカーネルの同時実行を防ぐロック（各カーネルは単独で全コアを使う）
+_parallel_lock = threading.Lock()
+
+
+def _serialized(kernel):
+    """カーネルをロックを取得してから呼び出す関数に変換"""
+    @wraps(kernel)
+    def wrapper(*args):
+        with _parallel_lock:
+            return kernel(*args)
+    return wrapper
+
+
+@njit(parallel=True, cache=True, nogil=True)
+def _nansum(a):
+    total = 0.0
+    for i in prange(a.size):
+        x = a[i]
+        if x == x:
+            total += x
+    return total
+
+
+@njit(parallel=True, cache=True, nogil=True)
+def _nanmean(a):
+    total = 0.0
+    count = 0
+    for i in prange(a.size):
+        x = a[i]
+        if x == x:
+            total += x
+            count += 1
+    if count == 0:
+        return np.nan
+    return total / count
+
+
+@njit(parallel=True, cache=True, nogil=True)
+def _nanvar(a, ddof=1):
+    mean = _nanmean(a)
+    sq = 0.0
+    count = 0
+    for i in prange(a.size):
+        x = a[i]
+        if x == x:
+            d = x - mean
+            sq += d * d
+            count += 1
+    if count - ddof <= 0:
+        return np.nan
+    return sq / (count - ddof)
+
+
+@njit(cache=True, nogil=True)
+def _nanstd(a, ddof=1):
+    return np.sqrt(_nanvar(a, ddof))
+
+
+@njit(parallel=True, cache=True, nogil=True)
+def _nanmin(a):
+    result = np.inf
+    count = 0
+    for i in prange(a.size):
+        x = a[i]
+        if x == x:
+            result = min(result, x)
+            count += 1
+    if count == 0:
+        return np.nan
+    return result
+
+
+@njit(parallel=True, cache=True, nogil=True)
+def _nanmax(a):
+    result = -np.inf
+    count = 0
+    for i in prange(a.size):
+        x = a[i]
+        if x == x:
+            result = max(result, x)
+            count += 1
+    if count == 0:
+        return np.nan
+    return result
+
+
+nansum = _serialized(_nansum)
+nanmean = _serialized(_nanmean)
+nanvar = _serialized(_nanvar)
+nanstd = _serialized(_nanstd)
+nanmin = _serialized(_nanmin)
+nanmax = _serialized(_nanmax)
+
+
+@njit(cache=True, nogil=True)
+def describe_stats(a):
+    """件数・平均・標準偏差・最小・最大を1パスで計算（Welford法）"""
+    count = 0
+    mean = 0.0
+    m2 = 0.0
+    lo = np.inf
+    hi = -np.inf
+    for i in range(a.size):
+        x = a[i]
+        if x != x:
+            continue
+        count += 1
+        delta = x - mean
+        mean += delta / count
+        m2 += delta * (x - mean)
+        if x < lo:
+            lo = x
+        if x > hi:
+            hi = x
+    if count == 0:
+        return 0, np.nan, np.nan, np.nan, np.nan
+    std = np.sqrt(m2 / (count - 1)) if count > 1 else np.nan
+    return count, mean, std, lo, hi
+
+
+@njit(parallel=True, cache=True, nogil=True)
+def _group_sum_codes(codes, values, n_groups, n_chunks):
+    # チャンクごとに部分和を持ち、最後に足し合わせる（書き込み競合を避ける）
+    # n_chunksは呼び出し側で渡す（カーネル内でget_num_threadsを呼ぶとcache=Trueが効かない）
+    chunk_size = (codes.size + n_chunks - 1) // n_chunks
+    partial = np.zeros((n_chunks, n_groups))
+    for c in prange(n_chunks):
+        for i in range(c * chunk_size, min((c + 1) * chunk_size, codes.size)):
+            code = codes[i]
+            x = values[i]
+            # 欠損キー（code=-1）と欠損値は集計しない
+            if code >= 0 and x == x:
+                partial[c, code] += x
+    return partial.sum(axis=0)
+
+
+def group_sum(
+    codes: np.ndarray, uniques: pd.Index, values: np.ndarray, k: Optional[int] = None
+) -> Tuple[pd.Index, np.ndarray]:
+    """factorize済みのキーごとの合計を計算し、合計の降順に上位k件を返す"""
+    with _parallel_lock:
+        sums = _group_sum_codes(codes, values, len(uniques), get_num_threads())
+    if k is not None and k < sums.size:
+        # 上位k件だけを選んでから並べ替える
+        top = np.argpartition(-sums, k - 1)[:k]
+        order = top[np.argsort(-sums[top], kind='stable')]
+    else:
+        order = np.argsort(-sums, kind='stable')
+    return pd.Index(uniques[order]), sums[order]
@@ -0,0 +1,175 @@
+"""execute_pandas_queryで実行する式の検証とコンパイル
+
+参照できる名前・属性・構文はすべて許可リストで制限する。
+"""
+import ast
+from functools import lru_cache
+from types import CodeType, SimpleNamespace
+from typing import Any, Dict
+
+import numpy as np
+import pandas as pd
+from pandas.core.groupby import DataFrameGroupBy, SeriesGroupBy
+
+# 式の中で参照できるDataFrameの名前
+_DATA_NAME = 'df'
+
+# pd/npから参照できる関数・定数（モジュールそのものは式に渡さない）
+_MODULE_ATTRIBUTES = {
+    'pd': frozenset({
+        'DataFrame', 'Series', 'Grouper', 'NamedAgg', 'Timestamp', 'Timedelta',
+        'to_datetime', 'to_numeric', 'to_timedelta', 'date_range', 'period_range',
+        'cut', 'qcut', 'concat', 'crosstab', 'pivot_table', 'isna', 'notna',
+    }),
+    'np': frozenset({
+        'nan', 'inf', 'pi', 'int64', 'float64',
+        'where', 'select', 'abs', 'round', 'floor', 'ceil', 'sign', 'sqrt', 'exp',
+        'log', 'log10', 'log1p', 'power', 'maximum', 'minimum', 'clip',
+        'sum', 'mean', 'median', 'std', 'var', 'min', 'max', 'prod', 'cumsum',
+        'nansum', 'nanmean', 'nanmedian', 'nanstd', 'nanvar', 'nanmin', 'nanmax',
+        'percentile', 'quantile', 'corrcoef', 'histogram', 'diff', 'isnan',
+        'unique', 'sort', 'argsort', 'arange', 'array',
+    }),
+}
+
+# DataFrame/Series/GroupBy/アクセサ（str, dt, cat）などで参照できる属性
+_ALLOWED_ATTRIBUTES = frozenset({
+    # 参照・選択
+    'loc', 'iloc', 'at', 'iat', 'columns', 'index', 'values', 'shape', 'size',
+    'dtypes', 'dtype', 'ndim', 'empty', 'name', 'T', 'head', 'tail', 'sample',
+    'filter', 'get', 'isin', 'between', 'where', 'mask', 'nlargest', 'nsmallest',
+    'drop', 'drop_duplicates', 'duplicated', 'dropna', 'fillna', 'isna', 'isnull',
+    'notna', 'notnull', 'copy', 'rename', 'astype', 'to_frame', 'to_list', 'tolist',
+    'to_numpy', 'to_dict', 'to_period', 'to_timestamp', 'items', 'keys',
+    # 集計
+    'sum', 'mean', 'median', 'min', 'max', 'count', 'std', 'var', 'sem', 'skew',
+    'kurt', 'prod', 'quantile', 'describe', 'nunique', 'unique', 'value_counts',
+    'mode', 'idxmax', 'idxmin', 'any', 'all', 'first', 'last', 'corr', 'cov',
+    'cumsum', 'cumprod', 'cummax', 'cummin', 'pct_change', 'diff', 'shift', 'rank',
+    'round', 'abs', 'clip', 'agg', 'aggregate', 'apply', 'map', 'transform',
+    'pipe', 'ngroups', 'groups',
+    # 並べ替え・変形
+    'groupby', 'sort_values', 'sort_index', 'reset_index', 'set_index',
+    'pivot', 'pivot_table', 'melt', 'stack', 'unstack', 'merge', 'join',
+    'assign', 'explode', 'rolling', 'expanding', 'resample', 'reindex',
+    # 文字列アクセサ
+    'str', 'contains', 'startswith', 'endswith', 'lower', 'upper', 'strip',
+    'len', 'replace', 'split', 'slice', 'zfill', 'extract',
+    # 日付アクセサ
+    'dt', 'year', 'month', 'day', 'hour', 'minute', 'quarter', 'week',
+    'weekday', 'dayofweek', 'dayofyear', 'date', 'days', 'month_name',
+    'day_name', 'strftime', 'floor', 'ceil', 'normalize', 'total_seconds',
+    # カテゴリアクセサ
+    'cat', 'categories', 'codes',
+})
+
+# 文字列で渡すと同名のメソッドが呼ばれうる名前（agg('to_csv')など）
+_METHOD_NAMES = frozenset(
+    name
+    for cls in (pd.DataFrame, pd.Series, DataFrameGroupBy, SeriesGroupBy)
+    for name in dir(cls)
+)
+
+# セッション中キャッシュされるdfや集計用配列を書き換える引数（inplace=True, np.abs(a, out=a)など）
+_MUTATING_KEYWORDS = frozenset({'inplace', 'out'})
+
+# 許可する構文（演算子・比較子・コンテキストは基底クラスで許可）
+_ALLOWED_NODES = (
+    ast.Expression, ast.Call, ast.keyword, ast.Attribute, ast.Name, ast.Subscript,
+    ast.Slice, ast.Constant, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare,
+    ast.IfExp, ast.List, ast.Tuple, ast.Dict, ast.Lambda, ast.arguments, ast.arg,
+    ast.operator, ast.unaryop, ast.boolop, ast.cmpop, ast.Load,
+)
+
+# コンパイル済みクエリのキャッシュ件数（セッションをまたいで共有）
+QUERY_CACHE_SIZE = 1024
+
+
+def _namespace(module: Any, names: frozenset) -> SimpleNamespace:
+    """モジュールのうち許可した属性だけを持つ名前空間"""
+    return SimpleNamespace(**{name: getattr(module, name) for name in names})
+
+
+# evalに渡すグローバル変数（dfは実行時に追加する）
+QUERY_GLOBALS: Dict[str, Any] = {
+    "__builtins__": {},
+    "pd": _namespace(pd, _MODULE_ATTRIBUTES['pd']),
+    "np": _namespace(np, _MODULE_ATTRIBUTES['np']),
+}
+
+
+class QueryValidator(ast.NodeVisitor):
+    """pandasクエリのASTを検証し、許可されていない操作を拒否する"""
+
+    def __init__(self):
+        self.allowed_names = frozenset({_DATA_NAME})
+
+    def visit(self, node: ast.AST) -> None:
+        if not isinstance(node, _ALLOWED_NODES):
+            raise ValueError(f"Syntax '{type(node).__name__}' is not allowed")
+        super().visit(node)
+
+    def visit_Attribute(self, node: ast.Attribute) -> None:
+        if node.attr.startswith('_'):
+            raise ValueError(f"Access to private attribute '{node.attr}' is not allowed")
+
+        # pd/npは許可した関数の参照としてのみ使える
+        if isinstance(node.value, ast.Name) and node.value.id in _MODULE_ATTRIBUTES:
+            if node.attr not in _MODULE_ATTRIBUTES[node.value.id]:
+                raise ValueError(f"Access to '{node.value.id}.{node.attr}' is not allowed")
+            return
+
+        if node.attr not in _ALLOWED_ATTRIBUTES:
+            raise ValueError(f"Access to '{node.attr}' is not allowed")
+        self.generic_visit(node)
+
+    def visit_Name(self, node: ast.Name) -> None:
+        if node.id in _MODULE_ATTRIBUTES:
+            raise ValueError(f"'{node.id}' can only be used as {node.id}.<function>")
+        if node.id not in self.allowed_names:
+            raise ValueError(f"Name '{node.id}' is not allowed")
+
+    def visit_Call(self, node: ast.Call) -> None:
+        # dfはセッション中キャッシュされるため、その場で書き換える呼び出しは許可しない
+        for keyword in node.keywords:
+            if keyword.arg is None:
+                raise ValueError("Keyword argument unpacking (**) is not allowed")
+            if keyword.arg in _MUTATING_KEYWORDS:
+                raise ValueError(f"Keyword argument '{keyword.arg}' is not allowed")
+
+        # agg('to_csv', ...)のように文字列でメソッドを呼ばせない
+        for arg in [*node.args, *(keyword.value for keyword in node.keywords)]:
+            self._check_string_arguments(arg)
+        self.generic_visit(node)
+
+    def visit_Lambda(self, node: ast.Lambda) -> None:
+        # lambdaの引数名はその本体の中でのみ許可する
+        outer = self.allowed_names
+        self.allowed_names = outer | {arg.arg for arg in node.args.args}
+        self.generic_visit(node)
+        self.allowed_names = outer
+
+    def _check_string_arguments(self, node: ast.AST) -> None:
+        """引数（リスト・タプル・dictの値を含む）の文字列が許可外のメソッド名でないか確認"""
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            if node.value in _METHOD_NAMES and node.value not in _ALLOWED_ATTRIBUTES:
+                raise ValueError(f"Method name '{node.value}' is not allowed as an argument")
+        elif isinstance(node, (ast.List, ast.Tuple)):
+            for element in node.elts:
+                self._check_string_arguments(element)
+        elif isinstance(node, ast.Dict):
+            for value in node.values:
+                self._check_string_arguments(value)
+
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def compile_query(query: str) -> CodeType:
+    """pandasクエリをASTで検証してコンパイル（検証に失敗したクエリはキャッシュされない）"""
+    # クエリがすでに"df"・"pd."・"np."で始まっている場合は追加しない
+    expression = query.strip()
+    if not expression.startswith(('df.', 'df[', 'pd.', 'np.')):
+        expression = f"df.{expression}"
+
+    tree = ast.parse(expression, mode='eval')
+    QueryValidator().visit(tree)
+    return compile(tree, '<query>', 'eval')
@@ -1,140 +1,245 @@
 import asyncio
-import io
-import json
 import os
-import tempfile
+import threading
+import time
 import uuid
-from datetime import datetime, timedelta
-from typing import Tuple, Optional
+from datetime import datetime
+from functools import lru_cache, partial
+from typing import TYPE_CHECKING, Dict, Tuple, Optional
 
 import gradio as gr
-import matplotlib
-import matplotlib.pyplot as plt
+import numpy as np
+import orjson
 import pandas as pd
 import redis
 
 from app.config import settings
 from csv_agents.csv_agent import CSVAgent
+from services.csv_loader import optimize_dtypes, read_csv_file
+from services.session_store import (
+    SESSION_TTL,
+    build_manifest,
+    load_cache_columns,
+    meta_key,
+    remove_cache_file,
+    sweep_cache_files,
+    write_cache_file,
+)
+
+if TYPE_CHECKING:
+    from matplotlib.axes import Axes
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
 
 # OpenAI API keyを環境変数に設定（トレーシング警告の抑制）
 if not os.getenv('OPENAI_API_KEY'):
     os.environ['OPENAI_API_KEY'] = settings.openai_api_key
 
-matplotlib.use('Agg')
+# グラフ画像の解像度
+CHART_DPI = 100
+
+# グラフ描画の排他制御（Figureは1つを使い回す）
+_chart_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def _ensure_mpl() -> Tuple["Figure", "FigureCanvasAgg", "Axes"]:
+    """matplotlibの読み込み・設定と共有Figureの作成を最初の描画まで遅らせる"""
+    import matplotlib
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    
+    # 日本語フォントの設定
+    matplotlib.rcParams['font.sans-serif'] = ['Hiragino Sans', 'Yu Gothic', 'Meiryo', 'Takao', 'IPAexGothic', 'IPAPGothic', 'Noto Sans CJK JP', 'DejaVu Sans']
+    matplotlib.rcParams['axes.unicode_minus'] = False
+    
+    # 描画パスを間引いてAggのレンダリングを軽くする
+    matplotlib.rcParams['path.simplify_threshold'] = 1.0
+    matplotlib.rcParams['agg.path.chunksize'] = 10000
+    
+    # pyplotのグローバル状態を経由せずAggで直接描画する
+    fig = Figure(figsize=(10, 6), dpi=CHART_DPI)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    return fig, canvas, ax
+
+
+# エージェント実行用の常駐イベントループ
+# リクエストごとにループを作り直さず、Agents SDK内部のHTTP接続を使い回す
+_LOOP = asyncio.new_event_loop()
+threading.Thread(target=_LOOP.run_forever, name="agent-loop", daemon=True).start()
 
-# 日本語フォントの設定
-plt.rcParams['font.sans-serif'] = ['Hiragino Sans', 'Yu Gothic', 'Meiryo', 'Takao', 'IPAexGothic', 'IPAPGothic', 'Noto Sans CJK JP', 'DejaVu Sans']
-plt.rcParams['axes.unicode_minus'] = False
 
-# Redis client
-redis_client = redis.from_url(settings.redis_url, decode_responses=True)
+@lru_cache(maxsize=1)
+def _redis() -> redis.Redis:
+    """Redis client（DataFrameをバイナリで保存するためデコードしない。初回の利用時に作成）"""
+    return redis.from_url(settings.redis_url, decode_responses=False)
 
-# グローバル状態
-current_session = None
 
-def create_chart_from_params(viz_data: dict) -> Optional[str]:
-    """可視化パラメータから画像を生成"""
+# セッションごとのCSVAgentキャッシュ（session_id -> (有効期限のUNIX時刻, agent)）
+_AGENT_CACHE: Dict[str, Tuple[float, CSVAgent]] = {}
+_agent_cache_lock = threading.Lock()
+
+
+def _get_agent(session_id: str) -> Optional[CSVAgent]:
+    """セッションのエージェントを取得（キャッシュになければマニフェストとローカルファイルから復元）"""
+    # 期限切れのエントリを削除
+    now = time.time()
+    with _agent_cache_lock:
+        expired = [sid for sid, (expires_at, _) in _AGENT_CACHE.items() if expires_at <= now]
+        for sid in expired:
+            del _AGENT_CACHE[sid]
+        
+        entry = _AGENT_CACHE.get(session_id)
+    
+    for sid in expired:
+        remove_cache_file(sid)
+    
+    if entry:
+        return entry[1]
+    
+    # セッションのマニフェストを取得
+    session_data = _redis().get(meta_key(session_id))
+    if not session_data:
+        return None
+    
+    session_info = orjson.loads(session_data)
+    
+    # 列データはクエリ・ツールが参照したものだけを後から読み込む
+    df = pd.DataFrame(index=pd.RangeIndex(session_info["shape"][0]))
+    agent = CSVAgent(
+        df,
+        session_info["filename"],
+        manifest=session_info,
+        column_loader=partial(load_cache_columns, session_info["path"])
+    )
+    
+    expires_at = (datetime.fromisoformat(session_info["created_at"]) + SESSION_TTL).timestamp()
+    # 同時に復元された場合は先にキャッシュされたエージェントを使う
+    with _agent_cache_lock:
+        entry = _AGENT_CACHE.setdefault(session_id, (expires_at, agent))
+    return entry[1]
+
+
+def create_chart_from_params(viz_data: dict) -> Optional[np.ndarray]:
+    """可視化パラメータから画像（RGBA配列）を生成"""
     try:
         chart_type = viz_data["chart_type"]
         data = viz_data["data_for_graph"]
         title = viz_data["title"]
         
-        plt.figure(figsize=(10, 6))
-        
-        # チャートタイプに応じた描画
-        chart_functions = {
-            "bar": lambda: _create_bar_chart(data),
-            "line": lambda: _create_line_chart(data),
-            "scatter": lambda: _create_scatter_chart(data),
-            "pie": lambda: _create_pie_chart(data),
-            "hist": lambda: _create_histogram(data),
-        }
-        
-        # チャートを描画
-        chart_function = chart_functions.get(chart_type, lambda: _create_bar_chart(data))
-        chart_function()
-        
-        plt.title(title)
-        plt.tight_layout()
-        
-        # システムのtempディレクトリに保存
-        with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp_file:
-            temp_path = tmp_file.name
-        
-        plt.savefig(temp_path, dpi=150, bbox_inches='tight')
-        plt.close()
-        
-        return temp_path
+        # 共有のFigureを使い回すため、描画〜バッファ取得は排他制御する
+        with _chart_lock:
+            fig, canvas, ax = _ensure_mpl()
+            ax.clear()
+            
+            # チャートタイプに応じた描画
+            chart_functions = {
+                "bar": lambda: _create_bar_chart(ax, data),
+                "line": lambda: _create_line_chart(ax, data),
+                "scatter": lambda: _create_scatter_chart(ax, data),
+                "pie": lambda: _create_pie_chart(ax, data),
+                "hist": lambda: _create_histogram(ax, data),
+            }
+            
+            # チャートを描画
+            chart_function = chart_functions.get(chart_type, lambda: _create_bar_chart(ax, data))
+            chart_function()
+            
+            ax.set_title(title)
+            fig.tight_layout()
+            
+            # PNGへのエンコードと一時ファイルを介さず、描画結果のバッファをそのまま渡す
+            # （バッファは次の描画で上書きされるためコピーする）
+            canvas.draw()
+            return np.array(canvas.buffer_rgba())
         
     except Exception as e:
         print(f"Error creating chart: {e}")
-        plt.close()
         return None
 
 
-def _create_bar_chart(data: dict) -> None:
+def _create_bar_chart(ax: "Axes", data: dict) -> None:
     """棒グラフを作成"""
-    plt.bar(data["x"], data["y"])
-    plt.xlabel(data["x_label"])
-    plt.ylabel(data["y_label"])
-    plt.xticks(rotation=45)
+    ax.bar(data["x"], data["y"])
+    ax.set_xlabel(data["x_label"])
+    ax.set_ylabel(data["y_label"])
+    ax.tick_params(axis='x', labelrotation=45)
 
 
-def _create_line_chart(data: dict) -> None:
+def _create_line_chart(ax: "Axes", data: dict) -> None:
     """折れ線グラフを作成"""
-    plt.plot(data["x"], data["y"], marker='o')
-    plt.xlabel(data["x_label"])
-    plt.ylabel(data["y_label"])
+    ax.plot(data["x"], data["y"], marker='o')
+    ax.set_xlabel(data["x_label"])
+    ax.set_ylabel(data["y_label"])
 
 
-def _create_scatter_chart(data: dict) -> None:
+def _create_scatter_chart(ax: "Axes", data: dict) -> None:
     """散布図を作成"""
-    plt.scatter(data["x"], data["y"])
-    plt.xlabel(data["x_label"])
-    plt.ylabel(data["y_label"])
+    ax.scatter(data["x"], data["y"])
+    ax.set_xlabel(data["x_label"])
+    ax.set_ylabel(data["y_label"])
 
 
-def _create_pie_chart(data: dict) -> None:
+def _create_pie_chart(ax: "Axes", data: dict) -> None:
     """円グラフを作成"""
-    plt.pie(data["y"], labels=data["x"], autopct='%1.1f%%')
+    ax.pie(data["y"], labels=data["x"], autopct='%1.1f%%')
 
 
-def _create_histogram(data: dict) -> None:
+def _create_histogram(ax: "Axes", data: dict) -> None:
     """ヒストグラムを作成"""
-    plt.hist(data["x"], bins=30, edgecolor='black')
-    plt.xlabel(data["x_label"])
-    plt.ylabel(data["y_label"])
-
-def upload_csv(file) -> Tuple[str, gr.update, gr.update]:
-    """CSVファイルをアップロードして処理"""
-    global current_session
+    if data["y"]:
+        # 度数はツール側で集計済み（xはビンの中心）
+        ax.bar(data["x"], data["y"], width=1.0, edgecolor='black')
+        ax.tick_params(axis='x', labelrotation=45)
+        ax.set_xlabel(data["x_label"])
+        ax.set_ylabel(data["y_label"])
+        return
     
+    try:
+        values = np.asarray(data["x"], dtype=float)
+    except ValueError:
+        # 数値に変換できない値はそのまま度数を描画
+        ax.hist(data["x"], bins=30, edgecolor='black')
+    else:
+        # 度数はNumPyで計算し、棒は1回のbar呼び出しでまとめて描画
+        values = values[~np.isnan(values)]
+        counts, edges = np.histogram(values, bins=30)
+        ax.bar(edges[:-1], counts, width=np.diff(edges), edgecolor='black', align='edge')
+    ax.set_xlabel(data["x_label"])
+    ax.set_ylabel(data["y_label"])
+
+def _save_session(df: pd.DataFrame, filename: str, session_id: str) -> Dict:
+    """データをローカルのArrow IPCファイルに保存し、Redisにはパスを含むマニフェストだけを保存（30分間）"""
+    # 期限切れのセッションが残したファイルを先に削除
+    sweep_cache_files()
+    session_data = build_manifest(df, filename)
+    session_data["path"] = write_cache_file(df, session_id)
+    _redis().setex(meta_key(session_id), SESSION_TTL, orjson.dumps(session_data, default=str))
+    return session_data
+
+async def upload_csv(
+    file, session_id: Optional[str], progress=gr.Progress()
+) -> Tuple[str, gr.update, gr.update, Optional[str]]:
+    """CSVファイルをアップロードして処理（新しいセッションIDをブラウザごとの状態として返す）"""
     if file is None:
-        return "ファイルが選択されていません", gr.update(visible=False), gr.update(visible=False)
+        return "ファイルが選択されていません", gr.update(visible=False), gr.update(visible=False), session_id
     
     try:
-        # CSVファイルを読み込む
-        df = pd.read_csv(file.name, encoding='utf-8')
+        # 解析・保存はスレッドで行い、その間も他の利用者のリクエストを処理できるようにする
+        # CSVファイルを読み込む（pyarrowで解析し、列の型を縮小してメモリを削減）
+        progress(0, desc="CSVファイルを読み込んでいます")
+        df = await asyncio.to_thread(lambda: optimize_dtypes(read_csv_file(file.name)))
         
         # セッションIDを生成
-        session_id = str(uuid.uuid4())
+        new_session_id = str(uuid.uuid4())
         
-        # データをRedisに保存（30分間）
-        session_data = {
-            "filename": file.name.split('/')[-1],
-            "columns": df.columns.tolist(),
-            "shape": df.shape,
-            "created_at": datetime.now().isoformat(),
-            "data": df.to_json(orient='records')
-        }
+        progress(0.7, desc="セッションを保存しています")
+        session_data = await asyncio.to_thread(_save_session, df, file.name.split('/')[-1], new_session_id)
         
-        redis_client.setex(
-            f"session:{session_id}",
-            timedelta(minutes=30),
-            json.dumps(session_data)
-        )
-        
-        current_session = session_id
+        # 以前のセッションのデータは不要になるため削除
+        if session_id:
+            await asyncio.to_thread(_discard_session, session_id)
         
         info_text = f"""
 ✅ ファイルアップロード成功！
@@ -146,37 +251,27 @@ def upload_csv(file) -> Tuple[str, gr.update, gr.update]:
 下記のテキストボックスに質問を入力してください。
         """
         
-        return info_text, gr.update(visible=True), gr.update(visible=True)
+        return info_text, gr.update(visible=True), gr.update(visible=True), new_session_id
         
     except Exception as e:
-        return f"❌ エラー: {str(e)}", gr.update(visible=False), gr.update(visible=False)
+        return f"❌ エラー: {str(e)}", gr.update(visible=False), gr.update(visible=False), session_id
 
-def process_query(query: str) -> Tuple[str, Optional[str]]:
+def process_query(query: str, session_id: Optional[str]) -> Tuple[str, Optional[np.ndarray]]:
     """クエリを処理して結果を返す"""
-    global current_session
-    
-    if not current_session:
+    if not session_id:
         return "まずCSVファイルをアップロードしてください", None
     
     if not query.strip():
         return "質問を入力してください", None
     
     try:
-        # セッションデータを取得
-        session_data = redis_client.get(f"session:{current_session}")
-        if not session_data:
+        # エージェントを取得（同じセッションでは使い回す）
+        agent = _get_agent(session_id)
+        if agent is None:
             return "セッションが期限切れです。再度CSVファイルをアップロードしてください", None
         
-        session_info = json.loads(session_data)
-        
-        # DataFrameを復元
-        df = pd.read_json(io.StringIO(session_info["data"]))
-        
-        # エージェントを初期化
-        agent = CSVAgent(df, session_info["filename"])
-        
         # CSVAgentのprocess_queryメソッドを使用
-        result = asyncio.run(agent.process_query(query))
+        result = asyncio.run_coroutine_threadsafe(agent.process_query(query), _LOOP).result()
         
         # ResponseCSVAgentオブジェクトから結果を取得
         response_text = result.result
@@ -190,9 +285,9 @@ def process_query(query: str) -> Tuple[str, Optional[str]]:
                 "title": result.visualization_data.title
             }
             
-            chart_path = create_chart_from_params(viz_data)
-            if chart_path:
-                return response_text, chart_path
+            chart_image = create_chart_from_params(viz_data)
+            if chart_image is not None:
+                return response_text, chart_image
         
         return response_text, None
         
@@ -202,11 +297,18 @@ def process_query(query: str) -> Tuple[str, Optional[str]]:
         print(traceback.format_exc())
         return f"❌ エラー: {str(e)}", None
 
-def reset_session() -> Tuple[str, gr.update, gr.update, None, None]:
+def _discard_session(session_id: str) -> None:
+    """セッションのエージェント・マニフェスト・ローカルファイルを削除"""
+    with _agent_cache_lock:
+        _AGENT_CACHE.pop(session_id, None)
+    _redis().delete(meta_key(session_id))
+    remove_cache_file(session_id)
+
+def reset_session(session_id: Optional[str]) -> Tuple[str, gr.update, gr.update, None, None, None]:
     """セッションをリセット"""
-    global current_session
-    current_session = None
-    return "新しいCSVファイルをアップロードしてください", gr.update(visible=False), gr.update(visible=False), None, None
+    if session_id:
+        _discard_session(session_id)
+    return "新しいCSVファイルをアップロードしてください", gr.update(visible=False), gr.update(visible=False), None, None, None
 
 # Gradioインターフェースを作成
 with gr.Blocks(title="CSV Query Agent", theme=gr.themes.Soft()) as app:
@@ -216,6 +318,9 @@ with gr.Blocks(title="CSV Query Agent", theme=gr.themes.Soft()) as app:
     CSVファイルをアップロードして、自然言語で質問してみましょう！
     """)
     
+    # ブラウザのセッションごとのセッションID（利用者間で共有しない）
+    session_state = gr.State(None)
+    
     with gr.Row():
         with gr.Column(scale=1):
             # ファイルアップロード
@@ -256,29 +361,32 @@ with gr.Blocks(title="CSV Query Agent", theme=gr.themes.Soft()) as app:
     # イベントハンドラー
     upload_btn.click(
         fn=upload_csv,
-        inputs=[file_input],
-        outputs=[upload_status, query_section, result_section]
+        inputs=[file_input, session_state],
+        outputs=[upload_status, query_section, result_section, session_state]
     )
     
     query_btn.click(
         fn=process_query,
-        inputs=[query_input],
+        inputs=[query_input, session_state],
         outputs=[result_text, result_image]
     )
     
     # Enterキーでクエリ実行
     query_input.submit(
         fn=process_query,
-        inputs=[query_input],
+        inputs=[query_input, session_state],
         outputs=[result_text, result_image]
     )
     
     reset_btn.click(
         fn=reset_session,
-        inputs=[],
-        outputs=[upload_status, query_section, result_section, result_text, result_image]
+        inputs=[session_state],
+        outputs=[upload_status, query_section, result_section, result_text, result_image, session_state]
     )
 
+# 複数の利用者のクエリを並行して処理する（エージェントは常駐イベントループ上で実行）
+app.queue(default_concurrency_limit=8)
+
 if __name__ == "__main__":
     app.launch(
         server_name="0.0.0.0",
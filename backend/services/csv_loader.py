@@ -0,0 +1,62 @@
+import re
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+# 日付とみなす文字列パターン（例: 2024-01-01, 2024/1/1）
+_DATE_RE = re.compile(r"^\d{4}[-/]\d{1,2}[-/]\d{1,2}")
+
+# 日付判定に使うサンプル行数
+_DATE_SAMPLE_SIZE = 100
+
+
+def _looks_like_date(series: pd.Series) -> bool:
+    """先頭の値が日付形式の文字列かどうかを判定"""
+    sample = series.dropna().head(_DATE_SAMPLE_SIZE)
+    if sample.empty:
+        return False
+    return bool(sample.astype(str).str.match(_DATE_RE).all())
+
+
+def optimize_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """日付形式の文字列列をdatetimeに変換
+
+    数値列はint64/float64のまま残す（ダウンキャストすると式の桁あふれや集計値の誤差が生じるため）。
+    文字列列はcategoryに変換しない（value_countsやgroupbyに出現しないカテゴリの行が加わるなど、
+    execute_pandas_queryの式の結果が変わるため）。
+    """
+    for col in df.select_dtypes(include="object").columns:
+        if _looks_like_date(df[col]):
+            try:
+                df[col] = pd.to_datetime(df[col])
+            except (ValueError, TypeError):
+                pass
+
+    return df
+
+
+def _read_csv(contents: bytes, encoding: str) -> pd.DataFrame:
+    """pyarrowのマルチスレッドCSVパーサーでバイト列を読み込む"""
+    table = pacsv.read_csv(
+        pa.BufferReader(contents),
+        read_options=pacsv.ReadOptions(encoding=encoding)
+    )
+    # 文字列として解釈できない列はbinary型になる（ヘッダーがASCIIのShift-JISファイルなど）
+    if any(pa.types.is_binary(field.type) for field in table.schema):
+        raise UnicodeDecodeError(encoding, b"", 0, 1, "column could not be decoded as text")
+    return table.to_pandas(date_as_object=False)
+
+
+def read_csv_bytes(contents: bytes) -> pd.DataFrame:
+    """CSVのバイト列をDataFrameに変換（UTF-8で読めない場合はShift-JISを試す）"""
+    try:
+        return _read_csv(contents, "utf-8")
+    except (pa.ArrowInvalid, UnicodeDecodeError):
+        return _read_csv(contents, "shift_jis")
+
+
+def read_csv_file(path: str) -> pd.DataFrame:
+    """CSVファイルをDataFrameに変換（read_csv_bytesと同じ文字コード判定を行う）"""
+    with open(path, 'rb') as f:
+        return read_csv_bytes(f.read())
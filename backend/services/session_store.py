@@ -0,0 +1,167 @@
+import os
+import pickle
+import struct
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import redis
+
+# セッションの保持期間（Redis TTL）
+SESSION_TTL = timedelta(minutes=30)
+
+# pickleで保存したペイロードの先頭に付ける識別子（Arrow IPCとの判別用）
+_PICKLE_MAGIC = b"PKL5"
+
+# get_data_info用にマニフェストへ保存するサンプル行数
+SAMPLE_ROWS = 3
+
+# セッションのデータをローカルファイルに置く場合の保存先
+CACHE_DIR = Path(tempfile.gettempdir()) / "csv_cache"
+
+
+def meta_key(session_id: str) -> str:
+    """セッションのマニフェスト（メタデータ・スキーマ）のRedisキー"""
+    return f"session:{session_id}"
+
+
+def column_key(session_id: str, column: str) -> str:
+    """列データ（Arrow IPC）のRedisキー"""
+    return f"session:{session_id}:col:{column}"
+
+
+def build_manifest(df: pd.DataFrame, filename: str) -> Dict[str, Any]:
+    """列データを読み込まずに参照できるセッションのメタデータ・スキーマを作成"""
+    return {
+        "filename": filename,
+        "columns": df.columns.tolist(),
+        "shape": list(df.shape),
+        "dtypes": {col: str(dtype) for col, dtype in df.dtypes.items()},
+        "sample_data": df.head(SAMPLE_ROWS).to_dict('records'),
+        "created_at": datetime.now().isoformat()
+    }
+
+
+def _pickle_dataframe(df: pd.DataFrame) -> bytes:
+    """DataFrameをpickle protocol 5（out-of-bandバッファ）でバイト列に変換
+
+    形式: MAGIC | バッファ数(uint32) | 各チャンク長(uint64) | pickle本体 | バッファ...
+    """
+    buffers: List[pickle.PickleBuffer] = []
+    data = pickle.dumps(df, protocol=5, buffer_callback=buffers.append)
+    raws = [buffer.raw() for buffer in buffers]
+    header = struct.pack(
+        f"<I{len(raws) + 1}Q", len(raws), len(data), *(raw.nbytes for raw in raws)
+    )
+    return b"".join([_PICKLE_MAGIC, header, data, *raws])
+
+
+def _unpickle_dataframe(payload: bytes) -> pd.DataFrame:
+    """_pickle_dataframeで作成したバイト列からDataFrameを復元（バッファはコピーしない）"""
+    view = memoryview(payload)
+    offset = len(_PICKLE_MAGIC)
+    (n_buffers,) = struct.unpack_from("<I", view, offset)
+    offset += 4
+    sizes = struct.unpack_from(f"<{n_buffers + 1}Q", view, offset)
+    offset += 8 * len(sizes)
+    
+    chunks = []
+    for size in sizes:
+        chunks.append(view[offset:offset + size])
+        offset += size
+    
+    # 自プロセスが書き込んだセッションデータのみを読み込むためpickleを許容する
+    return pickle.loads(chunks[0], buffers=chunks[1:])
+
+
+def serialize_dataframe(df: pd.DataFrame) -> bytes:
+    """DataFrameをArrow IPCストリーム形式のバイト列に変換
+
+    Arrowで表現できない列（型の混在したobject列など）はpickleで保存する。
+    """
+    try:
+        table = pa.Table.from_pandas(df)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        return _pickle_dataframe(df)
+    
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def deserialize_dataframe(payload: bytes) -> pd.DataFrame:
+    """serialize_dataframeで作成したバイト列からDataFrameを復元"""
+    if payload.startswith(_PICKLE_MAGIC):
+        return _unpickle_dataframe(payload)
+    
+    table = pa.ipc.open_stream(pa.BufferReader(payload)).read_all()
+    return table.to_pandas(zero_copy_only=False)
+
+
+def serialize_columns(df: pd.DataFrame) -> Dict[str, bytes]:
+    """列ごとに個別のArrow IPCバイト列へ変換（列単位で読み込めるようにする）"""
+    return {col: serialize_dataframe(df[[col]]) for col in df.columns}
+
+
+def deserialize_columns(payloads: List[bytes]) -> pd.DataFrame:
+    """列ごとのArrow IPCバイト列を1つのDataFrameに復元"""
+    return pd.concat([deserialize_dataframe(payload) for payload in payloads], axis=1)
+
+
+def load_columns(client: redis.Redis, session_id: str, columns: List[str]) -> pd.DataFrame:
+    """指定した列だけをRedisから読み込む"""
+    payloads = client.mget([column_key(session_id, col) for col in columns])
+    if any(payload is None for payload in payloads):
+        raise KeyError("Session not found or expired")
+    
+    return deserialize_columns(payloads)
+
+
+def cache_path(session_id: str) -> Path:
+    """セッションのデータ（Arrow IPCファイル）のローカルパス"""
+    return CACHE_DIR / f"{session_id}.arrow"
+
+
+def write_cache_file(df: pd.DataFrame, session_id: str) -> str:
+    """DataFrameをArrow IPCファイル（Feather V2）としてローカルに保存し、パスを返す
+
+    無圧縮で保存し、読み込み時はメモリマップで必要な列だけを参照する。
+    """
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    path = cache_path(session_id)
+    feather.write_feather(df, path, compression="uncompressed")
+    return str(path)
+
+
+def load_cache_columns(path: str, columns: List[str]) -> pd.DataFrame:
+    """ローカルのArrow IPCファイルから指定した列だけを読み込む"""
+    if not os.path.exists(path):
+        raise KeyError("Session not found or expired")
+    
+    table = feather.read_table(path, columns=columns, memory_map=True)
+    return table.to_pandas()
+
+
+def remove_cache_file(session_id: str) -> None:
+    """ローカルに保存したセッションのデータを削除"""
+    cache_path(session_id).unlink(missing_ok=True)
+
+
+def sweep_cache_files(max_age: timedelta = SESSION_TTL) -> None:
+    """保持期間を過ぎたローカルのセッションデータを削除（プロセス再起動などで残ったファイルも対象）"""
+    if not CACHE_DIR.exists():
+        return
+    
+    cutoff = datetime.now().timestamp() - max_age.total_seconds()
+    for path in CACHE_DIR.glob("*.arrow"):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink(missing_ok=True)
+        except FileNotFoundError:
+            # 他のスレッドが同時に削除した場合
+            continue
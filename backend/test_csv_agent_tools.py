@@ -0,0 +1,131 @@
+"""CSVAgentの集計・可視化ヘルパーのテスト（APIは呼び出さない）"""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("agents")
+pytest.importorskip("numba")
+
+from csv_agents.csv_agent import HIST_BINS, JIT_MIN_SIZE, MAX_POINTS, CSVAgent  # noqa: E402
+from services.csv_loader import optimize_dtypes, read_csv_file  # noqa: E402
+
+SAMPLE_CSV = Path(__file__).resolve().parent.parent / "sample_data.csv"
+
+
+@pytest.fixture
+def sample_df() -> pd.DataFrame:
+    return optimize_dtypes(read_csv_file(str(SAMPLE_CSV)))
+
+
+def make_agent(df: pd.DataFrame) -> CSVAgent:
+    return CSVAgent(df, "sample_data.csv")
+
+
+def test_date_chart_sums_by_day(sample_df):
+    """日付列のグラフは日単位で合計し、日付の昇順に並べる"""
+    params = make_agent(sample_df).visualization_params("line", "日付", "売上金額")
+    expected = sample_df.groupby(sample_df["日付"].dt.strftime("%Y-%m-%d"))["売上金額"].sum()
+    assert params["data_for_graph"]["x"] == expected.index.tolist()
+    assert params["data_for_graph"]["y"] == expected.astype(float).tolist()
+
+
+def test_unparseable_date_chart_groups_by_string():
+    """日付として解析できない形式（2024年01月01日など）は文字列のままグループ化する"""
+    df = pd.DataFrame({
+        "日付": ["2024年01月01日", "2024年01月01日", "2024年01月02日"],
+        "売上金額": [100, 200, 300],
+    })
+    params = make_agent(df).visualization_params("bar", "日付", "売上金額")
+    assert params["data_for_graph"]["x"] == ["2024年01月01日", "2024年01月02日"]
+    assert params["data_for_graph"]["y"] == [300.0, 300.0]
+
+
+@pytest.fixture
+def large_df() -> pd.DataFrame:
+    n_rows = MAX_POINTS * 4
+    return pd.DataFrame({
+        "行": np.arange(n_rows),
+        "値": np.arange(n_rows, dtype=np.float64) * 2,
+    })
+
+
+@pytest.mark.parametrize("chart_type", ["line", "bar"])
+def test_large_line_and_bar_charts_are_binned(large_df, chart_type):
+    """折れ線・棒グラフは行の順序でMAX_POINTS個の区間に分け、区間ごとの平均を返す"""
+    data = make_agent(large_df).visualization_params(chart_type, "行", "値")["data_for_graph"]
+    assert len(data["x"]) == len(data["y"]) == MAX_POINTS
+    # 4行ずつの区間の先頭の行番号と、値の平均
+    assert data["x"][:3] == ["0", "4", "8"]
+    assert data["y"][:3] == [3.0, 11.0, 19.0]
+    assert data["x"][-1] == str(len(large_df) - 4)
+
+
+def test_large_scatter_is_stratified(large_df):
+    """散布図は行の区間ごとに1行ずつ抽出し、行の順序と対応するx・yの組を保つ"""
+    data = make_agent(large_df).visualization_params("scatter", "行", "値")["data_for_graph"]
+    rows = np.array(data["x"], dtype=np.int64)
+    assert rows.size == MAX_POINTS
+    np.testing.assert_array_equal(rows // 4, np.arange(MAX_POINTS))
+    np.testing.assert_array_equal(np.array(data["y"]), rows * 2.0)
+
+
+def test_small_chart_is_not_resampled(sample_df):
+    """点数がMAX_POINTS以下のグラフはすべての行を返す"""
+    data = make_agent(sample_df).visualization_params("line", "販売数量", "売上金額")["data_for_graph"]
+    assert data["x"] == sample_df["販売数量"].astype(str).tolist()
+    assert data["y"] == sample_df["売上金額"].astype(float).tolist()
+
+
+def test_histogram_is_binned(large_df):
+    """数値列のヒストグラムは度数に集計し、ビン中央値を固定小数点表記のラベルで返す"""
+    large_df.loc[0, "値"] = np.nan
+    data = make_agent(large_df).visualization_params("histogram", "値")["data_for_graph"]
+    assert len(data["x"]) == len(data["y"]) == HIST_BINS
+    assert sum(data["y"]) == len(large_df) - 1
+    assert all("e+" not in label for label in data["x"])
+    assert data["x"][-1] == "39,331"
+
+
+@pytest.mark.parametrize("n_rows", [1_000, JIT_MIN_SIZE])
+@pytest.mark.parametrize("operation", ["sum", "mean", "min", "max", "std", "var", "count"])
+def test_statistic_matches_pandas(n_rows, operation):
+    """NumPy・Numbaのどちらで集計しても、pandasの集計と同じ値を返す"""
+    rng = np.random.default_rng(0)
+    floats = rng.normal(100.0, 25.0, size=n_rows)
+    floats[::97] = np.nan
+    df = pd.DataFrame({"float": floats, "int": rng.integers(0, 10_000, size=n_rows)})
+    agent = make_agent(df)
+    for column in df.columns:
+        assert agent.statistic(column, operation) == pytest.approx(getattr(df[column], operation)(), rel=1e-9)
+
+
+@pytest.mark.parametrize("n_rows", [1_000, JIT_MIN_SIZE])
+def test_integer_statistic_keeps_integer_type(n_rows):
+    """整数列の合計・最小・最大は、列の大きさによらず整数のまま返す"""
+    values = np.arange(n_rows, dtype=np.int64)
+    agent = make_agent(pd.DataFrame({"int": values}))
+    for operation, expected in [("sum", values.sum()), ("min", 0), ("max", n_rows - 1)]:
+        result = agent.statistic("int", operation)
+        assert isinstance(result, (int, np.integer))
+        assert result == expected
+
+
+def test_grouped_chart_matches_pandas(sample_df):
+    """グループ別のグラフはキーごとの合計を降順に返す"""
+    data = make_agent(sample_df).visualization_params("bar", y_column="売上金額", groupby_column="店舗名")["data_for_graph"]
+    expected = sample_df.groupby("店舗名")["売上金額"].sum().sort_values(ascending=False)
+    assert data["x"] == expected.index.tolist()
+    assert data["y"] == expected.astype(float).tolist()
+
+
+def test_grouped_chart_returns_top_groups():
+    """グループ数がMAX_POINTSを超える場合は合計の大きい上位MAX_POINTS件だけを返す"""
+    n_groups = MAX_POINTS * 2
+    df = pd.DataFrame({"キー": np.arange(n_groups).astype(str), "値": np.arange(n_groups, dtype=np.float64)})
+    data = make_agent(df).visualization_params("bar", y_column="値", groupby_column="キー")["data_for_graph"]
+    assert len(data["x"]) == MAX_POINTS
+    assert data["y"][0] == n_groups - 1
+    assert data["y"][-1] == n_groups - MAX_POINTS
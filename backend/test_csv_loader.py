@@ -0,0 +1,65 @@
+"""CSV読み込みと型の最適化のテスト"""
+
+import numpy as np
+import pandas as pd
+
+from services.csv_loader import optimize_dtypes, read_csv_bytes, read_csv_file
+
+
+def test_numeric_columns_keep_64bit_dtypes():
+    """数値列はダウンキャストせず、int64/float64のまま残す"""
+    df = optimize_dtypes(read_csv_bytes(b"count,price,amount\n1,1.5,100\n2,2.25,\n3,4999.99,300\n"))
+    assert df["count"].dtype == np.int64
+    assert df["price"].dtype == np.float64
+    assert df["amount"].dtype == np.float64
+    assert df["price"].max() == 4999.99
+
+
+def test_sum_of_float_column_is_exact():
+    """欠損を含む整数値の列（float64で読まれる）の合計に丸め誤差が出ない"""
+    amounts = np.arange(90_000, dtype=np.int64) * 1_000 + 41
+    lines = ["id,売上金額"] + [f"{i},{value}" for i, value in enumerate(amounts)] + ["90000,"]
+    df = optimize_dtypes(read_csv_bytes("\n".join(lines).encode()))
+    assert df["売上金額"].dtype == np.float64
+    assert df["売上金額"].sum() == amounts.sum()
+    assert np.nansum(df["売上金額"].to_numpy()) == amounts.sum()
+
+
+def test_string_columns_are_not_categorical():
+    """文字列列はcategoryに変換せず、式の結果（value_counts・sum）が変わらない"""
+    contents = "商品名,店舗名,カテゴリ\n" + "ノートPC,東京店,PC\nマウス,大阪店,周辺機器\n" * 10
+    df = optimize_dtypes(read_csv_bytes(contents.encode()))
+    assert not isinstance(df["店舗名"].dtype, pd.CategoricalDtype)
+
+    counts = df[df["商品名"] == "ノートPC"]["店舗名"].value_counts()
+    assert counts.to_dict() == {"東京店": 10}
+    assert df["カテゴリ"].head(2).sum() == "PC周辺機器"
+
+
+def test_date_columns_are_parsed():
+    """日付形式の文字列列はdatetimeに変換する"""
+    df = optimize_dtypes(read_csv_bytes("日付,値\n2024/01/05,1\n2024/02/10,2\n".encode()))
+    assert df["日付"].dtype.kind == "M"
+
+
+def test_utf8():
+    """UTF-8のCSVはそのまま読み込む"""
+    df = read_csv_bytes("商品名,数量\nノートPC,3\n".encode("utf-8"))
+    assert df.columns.tolist() == ["商品名", "数量"]
+    assert df["商品名"].tolist() == ["ノートPC"]
+
+
+def test_shift_jis():
+    """UTF-8として読めない場合はShift-JISで読み込む"""
+    df = read_csv_bytes("商品名,数量\nノートPC,3\n".encode("shift_jis"))
+    assert df.columns.tolist() == ["商品名", "数量"]
+    assert df["商品名"].tolist() == ["ノートPC"]
+
+
+def test_shift_jis_with_ascii_header(tmp_path):
+    """ヘッダーがASCIIで値だけShift-JISの場合（pyarrowはbinary列と推定する）もShift-JISで読み込む"""
+    path = tmp_path / "sales.csv"
+    path.write_bytes("name,city\n田中,東京\n鈴木,大阪\n".encode("shift_jis"))
+    df = read_csv_file(str(path))
+    assert df["name"].tolist() == ["田中", "鈴木"]
+    assert df["city"].tolist() == ["東京", "大阪"]
@@ -0,0 +1,77 @@
+"""Numbaカーネルの集計結果をNumPy/pandasと比較するテスト"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("numba")
+
+from csv_agents import kernels  # noqa: E402
+
+
+@pytest.fixture
+def values() -> np.ndarray:
+    rng = np.random.default_rng(0)
+    array = rng.normal(100.0, 25.0, size=200_000)
+    array[rng.integers(0, array.size, size=1_000)] = np.nan
+    return array
+
+
+@pytest.mark.parametrize("kernel, reference", [
+    (kernels.nansum, np.nansum),
+    (kernels.nanmean, np.nanmean),
+    (kernels.nanmin, np.nanmin),
+    (kernels.nanmax, np.nanmax),
+    (kernels.nanstd, lambda a: np.nanstd(a, ddof=1)),
+    (kernels.nanvar, lambda a: np.nanvar(a, ddof=1)),
+])
+def test_reductions_match_numpy(kernel, reference, values):
+    """NaNをスキップした集計がNumPyのnan関数と一致する"""
+    assert kernel(values) == pytest.approx(reference(values), rel=1e-9)
+
+
+def test_all_nan_returns_nan():
+    """値がすべてNaNの場合、平均・最小・最大はNaN"""
+    array = np.full(10, np.nan)
+    assert kernels.nansum(array) == 0.0
+    assert np.isnan(kernels.nanmean(array))
+    assert np.isnan(kernels.nanmin(array))
+    assert np.isnan(kernels.nanmax(array))
+
+
+def test_describe_stats_matches_pandas(values):
+    """1パスで求めた件数・平均・標準偏差・最小・最大がSeries.describe()と一致する"""
+    count, mean, std, lo, hi = kernels.describe_stats(values)
+    expected = pd.Series(values).describe()
+    assert count == expected["count"]
+    assert mean == pytest.approx(expected["mean"], rel=1e-9)
+    assert std == pytest.approx(expected["std"], rel=1e-9)
+    assert lo == expected["min"]
+    assert hi == expected["max"]
+
+
+def test_group_sum_matches_pandas(values):
+    """キーごとの合計と並び順がgroupby().sum()の降順と一致する（欠損キーは除外）"""
+    rng = np.random.default_rng(1)
+    keys = pd.Series(rng.choice(["A", "B", "C", "D", None], size=values.size))
+    codes, uniques = pd.factorize(keys)
+
+    labels, sums = kernels.group_sum(codes, pd.Index(uniques), values)
+    expected = pd.Series(values).groupby(keys).sum().sort_values(ascending=False)
+    assert labels.tolist() == expected.index.tolist()
+    np.testing.assert_allclose(sums, expected.to_numpy(), rtol=1e-9)
+
+    # 上位k件だけを返す
+    top_labels, top_sums = kernels.group_sum(codes, pd.Index(uniques), values, k=2)
+    assert top_labels.tolist() == expected.index[:2].tolist()
+    np.testing.assert_allclose(top_sums, expected.to_numpy()[:2], rtol=1e-9)
+
+
+def test_concurrent_calls(values):
+    """複数のスレッドから同時に呼び出しても結果が変わらない"""
+    expected = np.nansum(values)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: kernels.nansum(values), range(32)))
+    assert results == pytest.approx([expected] * 32, rel=1e-9)
@@ -0,0 +1,110 @@
+"""execute_pandas_queryのクエリ検証のテスト"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from csv_agents.query_validator import QUERY_GLOBALS, compile_query
+
+
+@pytest.fixture
+def df() -> pd.DataFrame:
+    return pd.DataFrame({
+        "日付": pd.to_datetime(["2024-01-05", "2024-01-20", "2024-02-03", "2024-02-28"]),
+        "商品": ["A", "B", "A", "C"],
+        "売上": [100, 250, 300, 50],
+        "単価": [1.5, 2.0, np.nan, 4.0],
+    })
+
+
+def run_query(query: str, df: pd.DataFrame):
+    """csv_agentのツールと同じ方法でクエリを実行"""
+    return eval(compile_query(query), {**QUERY_GLOBALS, "df": df}, {})
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("df['売上'].sum()", 700),
+    ("groupby('商品')['売上'].sum().to_dict()", {"A": 400, "B": 250, "C": 50}),
+    ("df[df['売上'] > 100]['商品'].tolist()", ["B", "A"]),
+    ("df.groupby(df['日付'].dt.month)['売上'].sum().tolist()", [350, 350]),
+    ("df['商品'].str.contains('A').sum()", 2),
+    ("df['単価'].fillna(0).max()", 4.0),
+    ("df.assign(合計=lambda d: d['売上'] * 2)['合計'].sum()", 1400),
+    ("df['売上'].agg(['min', 'max']).tolist()", [50, 300]),
+    ("np.where(df['売上'] > 100, 1, 0).sum()", 2),
+    ("pd.to_datetime(df['日付']).dt.year.nunique()", 1),
+    ("df.pipe(lambda d: d['売上'].mean())", 175.0),
+])
+def test_allowed_queries(query, expected, df):
+    """集計・絞り込み・日付/文字列アクセサ・許可したpd/np関数は実行できる"""
+    assert run_query(query, df) == expected
+
+
+@pytest.mark.parametrize("query", [
+    # pd/npのモジュールを辿る
+    "df.pipe(lambda d: pd.io.common.os.getpid())",
+    "pd.io",
+    "np.lib",
+    "pd.DataFrame.to_csv",
+    "df.pipe(lambda d: pd)",
+    # ファイル・クリップボードへの出力や大きな文字列の生成
+    "df.to_csv('/tmp/x.csv')",
+    "df.to_json('/tmp/x.json')",
+    "df.to_html()",
+    "df.to_string(buf='/tmp/x.txt')",
+    "df.to_xml()",
+    "df.to_latex()",
+    "df.to_markdown()",
+    "df.to_clipboard()",
+    "df.to_pickle('/tmp/x.pkl')",
+    # 文字列でメソッドを呼ばせる
+    "df['売上'].agg('to_csv', 0, '/tmp/x')",
+    "df.agg(['sum', 'to_json'])",
+    "df.agg({'売上': 'to_pickle'})",
+    # dfやキャッシュ済みの配列をその場で書き換える
+    "df.drop(index=[0, 1, 2], inplace=True)",
+    "df.dropna(inplace=True)",
+    "df.rename(columns={'売上': 'x'}, inplace=True)",
+    "df['売上'].fillna(0, inplace=True)",
+    "df.pipe(lambda d: d.sort_values('売上', inplace=True))",
+    "df.rename(**{'columns': {'売上': 'x'}, 'inplace': True})",
+    "np.abs(df['単価'].to_numpy(), out=df['単価'].to_numpy())",
+    # 式の評価・描画
+    "df.query('売上 > 0')",
+    "df.eval('売上 * 2')",
+    "df.plot()",
+    # 組み込み・private属性・許可外の構文
+    "__import__('os').getpid()",
+    "open('/etc/passwd')",
+    "df.__class__",
+    "df._data",
+    "df.pipe(lambda d: '{0.__class__}'.format(d))",
+    "df.pipe(lambda d: [x for x in d])",
+    "df.pipe(lambda d: d.to_numpy().tofile('/tmp/x'))",
+])
+def test_rejected_queries(query):
+    """許可リストにない名前・属性・構文は検証で拒否される"""
+    with pytest.raises(ValueError):
+        compile_query(query)
+
+
+def test_lambda_arguments_are_scoped(df):
+    """lambdaの引数名はその本体の外では使えない"""
+    assert run_query("df['売上'].map(lambda x: x + 1).sum()", df) == 704
+    with pytest.raises(ValueError):
+        compile_query("df['売上'].map(lambda x: x) + x")
+
+
+def test_rejected_mutation_leaves_df_unchanged(df):
+    """書き換えを伴うクエリは実行前に拒否され、dfは変わらない"""
+    expected = df.copy()
+    with pytest.raises(ValueError):
+        run_query("df.drop(index=[0, 1], inplace=True)", df)
+    pd.testing.assert_frame_equal(df, expected)
+
+
+def test_rejected_query_is_not_cached():
+    """検証に失敗したクエリは何度実行しても拒否される"""
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            compile_query("df.to_csv('/tmp/x.csv')")
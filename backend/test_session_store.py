@@ -0,0 +1,68 @@
+"""セッションデータのシリアライズ（Arrow IPC / pickleフォールバック）のテスト"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("redis")
+
+from services.session_store import (  # noqa: E402
+    _PICKLE_MAGIC,
+    deserialize_columns,
+    deserialize_dataframe,
+    serialize_columns,
+    serialize_dataframe,
+)
+
+
+@pytest.fixture
+def df() -> pd.DataFrame:
+    return pd.DataFrame({
+        "日付": pd.to_datetime(["2024-01-05", "2024-01-20", "2024-02-03"]),
+        "商品": pd.Categorical(["A", "B", "A"]),
+        "売上": np.array([100, 250, 300], dtype=np.int64),
+        "単価": np.array([1.5, np.nan, 4.0], dtype=np.float32),
+        "備考": ["あ", None, "う"],
+    })
+
+
+def test_arrow_round_trip(df):
+    """Arrowで表現できるDataFrameはArrow IPCで保存され、値と型が復元される"""
+    payload = serialize_dataframe(df)
+    assert not payload.startswith(_PICKLE_MAGIC)
+    pd.testing.assert_frame_equal(deserialize_dataframe(payload), df)
+
+
+def test_pickle_fallback_round_trip():
+    """型の混在したobject列はpickleで保存され、同じ内容に復元される"""
+    df = pd.DataFrame({
+        "混在": pd.Series([1, "a", 2.5, None], dtype=object),
+        "値": np.arange(4, dtype=np.float64),
+    })
+    payload = serialize_dataframe(df)
+    assert payload.startswith(_PICKLE_MAGIC)
+    pd.testing.assert_frame_equal(deserialize_dataframe(payload), df)
+
+
+def test_pickle_fallback_with_large_buffers():
+    """out-of-bandバッファが複数ある場合もフレーミングが正しく読み戻される"""
+    df = pd.DataFrame({
+        "混在": pd.Series([1, "a"] * 50_000, dtype=object),
+        "a": np.arange(100_000, dtype=np.float64),
+        "b": np.arange(100_000, dtype=np.int64),
+    })
+    payload = serialize_dataframe(df)
+    assert payload.startswith(_PICKLE_MAGIC)
+    pd.testing.assert_frame_equal(deserialize_dataframe(payload), df)
+
+
+def test_columns_round_trip(df):
+    """列ごとに保存したバイト列から、任意の列の組み合わせを復元できる"""
+    payloads = serialize_columns(df)
+    assert list(payloads) == df.columns.tolist()
+
+    restored = deserialize_columns([payloads[col] for col in df.columns])
+    pd.testing.assert_frame_equal(restored, df)
+
+    subset = deserialize_columns([payloads["売上"], payloads["日付"]])
+    pd.testing.assert_frame_equal(subset, df[["売上", "日付"]])